@@ -0,0 +1,217 @@
+"""
+Benchmarks for the slow parts of the streak pipeline. They run on made-up shot
+data shaped like the kaggle CSVs, so they don't need the real data (or the
+network), and the same seed always makes the same data.
+
+run before and after a change, and compare:
+
+    python benchmarks.py --games 1230 --save before.json
+    python benchmarks.py --games 1230 --compare before.json
+
+--games 1230 is about the size of a real season.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import season_streaks
+import simulate_lukewarm
+import streak_converter
+import streaks_base
+import wald_wolfowitz
+
+ZONES = ["Restricted Area", "In The Paint (Non-RA)", "Mid-Range", "Above the Break 3",
+         "Left Corner 3", "Right Corner 3", "Backcourt"]
+NUM_TEAMS = 30
+
+# something this much slower than the saved run gets flagged
+DEFAULT_THRESHOLD = 1.2
+
+def make_shots(num_games=1230, players_per_team=10, shots_per_player=8, season=2024, seed=0):
+    """
+    a season of fake shots in the kaggle format, in no particular order (like
+    the real thing). every player takes a random number of shots each game
+    (`shots_per_player` on average), at their own FG%.
+    """
+    rng = np.random.default_rng(seed)
+    num_players = NUM_TEAMS * players_per_team
+    player_fg = rng.uniform(.35, .6, num_players)
+
+    # both teams of every game, then every player on those teams
+    home = rng.integers(0, NUM_TEAMS, num_games)
+    away = (home + rng.integers(1, NUM_TEAMS, num_games)) % NUM_TEAMS
+    game_teams = np.stack([home, away], axis=1).ravel()
+    game_players = (game_teams[:, None] * players_per_team + np.arange(players_per_team)).ravel()
+    game_index = np.repeat(np.arange(num_games), 2 * players_per_team)
+
+    shots_per_game = rng.poisson(shots_per_player, len(game_players))
+    player = np.repeat(game_players, shots_per_game)
+    game = np.repeat(game_index, shots_per_game)
+    num_shots = len(player)
+
+    # 48 minutes of game, in a random order
+    seconds_left = rng.integers(0, 48 * 60, num_shots)
+    game_dates = pd.Timestamp(f"{season - 1}-10-22") + pd.to_timedelta(game // 8, unit="D")
+    team = game_teams[(game * 2) + (player // players_per_team != home[game])]
+
+    return pd.DataFrame({
+        "SEASON_1": season,
+        "SEASON_2": f"{season - 1}-{str(season)[2:]}",
+        "TEAM_ID": 1610612737 + team,
+        "TEAM_NAME": [f"Team {t}" for t in team],
+        "PLAYER_ID": 1000 + player,
+        "PLAYER_NAME": [f"Player {p}" for p in player],
+        "GAME_DATE": game_dates.strftime("%m-%d-%Y"),
+        "GAME_ID": 20000000 + ((season - 1) % 100) * 100000 + game + 1,
+        "EVENT_TYPE": "",
+        "SHOT_MADE": rng.random(num_shots) < player_fg[player],
+        "BASIC_ZONE": rng.choice(ZONES, num_shots),
+        "SHOT_DISTANCE": rng.integers(0, 30, num_shots),
+        "QUARTER": 4 - (seconds_left // (12 * 60)),
+        "MINS_LEFT": (seconds_left % (12 * 60)) // 60,
+        "SECS_LEFT": seconds_left % 60,
+    }).assign(EVENT_TYPE=lambda df: np.where(df.SHOT_MADE, "Made Shot", "Missed Shot"))
+
+def measure(func, repeat=3):
+    """
+    runs func() once with tracemalloc on, to get its peak memory, then `repeat`
+    more times to time it. returns the fastest time, the peak memory in MB and
+    whatever func() returned.
+    """
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    return min(times), peak / 2**20, result
+
+def get_benchmarks(shots, season="2024", seed=0):
+    """
+    (name, function, {unit: count}) for everything that gets timed. throughput
+    is reported for each unit.
+    """
+    sorted_shots = season_streaks.fix_index(shots.copy())
+    season_df = season_streaks.get_streaks_for_season(season, shots=shots.copy())
+    careers = season_streaks.get_all_player_streaks(season_df)
+    player_seasons = [streak_converter.to_made_array(made)
+                      for _, made in sorted_shots.groupby("PLAYER_ID", sort=False)["SHOT_MADE"]]
+    pairs = season_df[["makes", "misses"]].drop_duplicates().values
+
+    num_shots = len(shots)
+    num_games = len(season_df)
+    num_players = len(careers)
+
+    def sim_season():
+        sim = simulate_lukewarm.SimulateLukewarm(season_df.reset_index())
+        sim.rng = np.random.default_rng(seed)
+        return sim.sim_season()
+
+    def calc_stats():
+        stats_df = careers[["player_id", "player_name", "makes", "misses", "total_streaks"]].copy()
+        return streaks_base.StreaksBase().calc_stats(stats_df, percentile_ranks=True)
+
+    return [
+        ("convert_to_streaks", lambda: [streak_converter.convert_to_streaks(made) for made in player_seasons],
+         {"shots": num_shots}),
+        ("get_streaks_for_season", lambda: season_streaks.get_streaks_for_season(season, shots=shots.copy()),
+         {"shots": num_shots, "player-games": num_games}),
+        ("get_all_player_streaks", lambda: season_streaks.get_all_player_streaks(season_df),
+         {"player-games": num_games}),
+        ("add_sequence_data", lambda: season_streaks.add_sequence_data(sorted_shots),
+         {"shots": num_shots}),
+        ("calc_stats", calc_stats, {"players": num_players}),
+        ("get_exact_pmf", lambda: [wald_wolfowitz.get_exact_pmf(makes, misses) for makes, misses in pairs],
+         {"pmfs": len(pairs)}),
+        ("sim_season", sim_season, {"player-games": num_games}),
+    ]
+
+def run(num_games=1230, players_per_team=10, shots_per_player=8, seed=0, repeat=3, only=None):
+    shots = make_shots(num_games, players_per_team, shots_per_player, seed=seed)
+    results = []
+    for name, func, units in get_benchmarks(shots, seed=seed):
+        if only and (name not in only):
+            continue
+        seconds, peak_mb, _ = measure(func, repeat)
+        results.append({
+            "name": name,
+            "seconds": seconds,
+            "peak_mb": peak_mb,
+            "throughput": {unit: count / seconds for unit, count in units.items()},
+        })
+        print(format_result(results[-1]))
+
+    return {
+        "params": {"num_games": num_games, "players_per_team": players_per_team,
+                   "shots_per_player": shots_per_player, "seed": seed, "num_shots": len(shots)},
+        "environment": {"python": sys.version.split()[0], "numpy": np.__version__,
+                        "pandas": pd.__version__, "machine": platform.machine()},
+        "results": results,
+    }
+
+def format_result(result):
+    throughput = ", ".join(f"{rate:,.0f} {unit}/s" for unit, rate in result["throughput"].items())
+    return f"{result['name']:<24} {result['seconds'] * 1000:9.1f} ms {result['peak_mb']:8.1f} MB   {throughput}"
+
+def compare(run_data, old_run_data, threshold=DEFAULT_THRESHOLD):
+    """
+    prints how each benchmark did against an earlier run. returns the names of
+    the ones that got slower by more than `threshold`.
+    """
+    if run_data["params"] != old_run_data["params"]:
+        print("warning: the saved run used different parameters", old_run_data["params"])
+
+    old_results = {result["name"]: result for result in old_run_data["results"]}
+    slower = []
+    for result in run_data["results"]:
+        old_result = old_results.get(result["name"])
+        if old_result is None:
+            continue
+        ratio = result["seconds"] / old_result["seconds"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- SLOWER"
+            slower.append(result["name"])
+        print(f"{result['name']:<24} {old_result['seconds'] * 1000:9.1f} ms -> "
+              f"{result['seconds'] * 1000:9.1f} ms  ({ratio:.2f}x){flag}")
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="time the streak pipeline on synthetic shot data")
+    parser.add_argument("--games", type=int, default=1230, help="games in the fake season")
+    parser.add_argument("--players-per-team", type=int, default=10)
+    parser.add_argument("--shots-per-player", type=int, default=8, help="average shots per player-game")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs (the fastest is kept)")
+    parser.add_argument("--only", nargs="*", help="just these benchmarks")
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    run_data = run(args.games, args.players_per_team, args.shots_per_player, args.seed,
+                   args.repeat, args.only)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(run_data, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_run_data = json.load(f)
+        if compare(run_data, old_run_data, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
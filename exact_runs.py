@@ -0,0 +1,228 @@
+"""
+Exact version of what simulate_lukewarm estimates by simulation.
+
+The streaky players only remember a little bit about the current game (their
+makes and attempts so far, or their last 5 shots), and forget it all at the end
+of the game. So the distribution of (makes, runs) for a game of n shots can be
+worked out exactly, one shot at a time, by keeping track of the probability of
+every state the player could be in. Games are independent, so a season is
+those game distributions added up over the player's actual shot counts (with
+one less run whenever a game starts with the same result the last one ended
+with).
+
+What comes out is the expected Wald-Wolfowitz z-score (and its sd) for every
+player, with no simulation noise:
+
+    results = exact_runs.exact_season(season_df, streaky_players.LukewarmPlayer)
+    exact_runs.summarize(results)   # same mean/std as simulate_lukewarm.run_ensemble
+
+Only the "normal" z-score (see wald_wolfowitz.get_streak_stats) is supported,
+since it's the one that's linear in the number of runs.
+"""
+
+import numpy as np
+import pandas as pd
+
+import streaky_players
+import wald_wolfowitz
+import instrumentation
+
+# LastFivePlayer's window
+LAST_FIVE = 5
+
+def get_make_probabilities(player, windows, makes, attempts):
+    """
+    the player's FG% for their next shot, for every combination of `windows`
+    (the last few shots, as bits, newest first) and `makes` so far in a game
+    with `attempts` shots so far. windows and makes should broadcast together.
+    """
+    shape = np.broadcast(windows, makes).shape
+    if hasattr(player, "get_shooting_percentages"):
+        return player.get_shooting_percentages(np.full(shape, player.shooting_percentage),
+                                               np.broadcast_to(makes, shape), attempts)
+    if isinstance(player, streaky_players.LastFivePlayer):
+        if attempts < LAST_FIVE:
+            return np.full(shape, player.base_rate)
+        by_makes = np.array([player.last5[num_makes] for num_makes in range(LAST_FIVE + 1)])
+        num_makes = np.array([bin(window).count("1") for window in range(2 ** LAST_FIVE)])
+        return np.broadcast_to(by_makes[num_makes[windows]], shape)
+    if isinstance(player, streaky_players.VariableFGPlayer):
+        # shot types are picked independently every shot, so it's the same as one average FG%
+        weights = player.shooting_weights / player.shooting_weights.sum()
+        return np.full(shape, np.dot(weights, player.shooting_percentages))
+    if type(player).get_shooting_percentage is streaky_players.BasePlayer.get_shooting_percentage:
+        return np.full(shape, player.shooting_percentage)
+    raise TypeError(f"don't know how {type(player).__name__} depends on earlier shots")
+
+@instrumentation.timed()
+def get_game_distributions(player, max_shots):
+    """
+    the exact distribution of (makes, runs, first shot, last shot) for a game of
+    every length up to max_shots. dists[n, makes, runs, first, last] is the
+    probability for an n shot game (dists[0] is all zero).
+
+    the player's FG% doesn't depend on how many shots are left in the game,
+    so every game length falls out of one pass.
+
+    >>> dists = get_game_distributions(streaky_players.NormalPlayer(.5), 3)
+    >>> dists[3].sum(axis=(0, 2, 3))
+    array([0.  , 0.25, 0.5 , 0.25])
+    """
+    num_windows = 2 ** LAST_FIVE if isinstance(player, streaky_players.LastFivePlayer) else 1
+    windows = np.arange(num_windows)
+    made_windows = ((windows << 1) | 1) & (num_windows - 1)
+    missed_windows = (windows << 1) & (num_windows - 1)
+    all_makes = np.arange(max_shots + 1)
+
+    dists = np.zeros((max_shots + 1, max_shots + 1, max_shots + 1, 2, 2))
+    # state[window, makes, runs, first, last]
+    state = np.zeros((num_windows, max_shots + 1, max_shots + 1, 2, 2))
+    for attempts in range(max_shots):
+        make_pct = get_make_probabilities(player, windows[:, None], all_makes[None, :], attempts)
+        new_state = np.zeros_like(state)
+        if attempts == 0:
+            new_state[made_windows[0], 1, 1, 1, 1] = make_pct[0, 0]
+            new_state[missed_windows[0], 0, 1, 0, 0] = 1 - make_pct[0, 0]
+        else:
+            made = state * make_pct[:, :, None, None, None]
+            missed = state - made
+
+            # a make after a make keeps the run going, after a miss it starts a new one
+            after_made = np.zeros_like(state)
+            after_made[:, 1:, :, :, 1] = made[:, :-1, :, :, 1]
+            after_made[:, 1:, 1:, :, 1] += made[:, :-1, :-1, :, 0]
+            after_missed = np.zeros_like(state)
+            after_missed[:, :, :, :, 0] = missed[:, :, :, :, 0]
+            after_missed[:, :, 1:, :, 0] += missed[:, :, :-1, :, 1]
+
+            np.add.at(new_state, made_windows, after_made)
+            np.add.at(new_state, missed_windows, after_missed)
+        state = new_state
+        dists[attempts + 1] = state.sum(axis=0)
+    return dists
+
+def get_run_moments(dists):
+    """
+    for every game length, P(makes, first, last) along with E[runs] and
+    E[runs^2] restricted to those cases (ie. summed, not divided by the probability).
+    """
+    runs = np.arange(dists.shape[2])[None, None, :, None, None]
+    return dists.sum(axis=2), (dists * runs).sum(axis=2), (dists * runs ** 2).sum(axis=2)
+
+def get_season_moments(run_moments, shots_per_game):
+    """
+    puts games end to end. returns P(makes), E[runs; makes] and E[runs^2; makes]
+    for the whole thing, indexed by the total number of makes.
+    """
+    game_p, game_r, game_q = run_moments
+    shots_per_game = [n for n in shots_per_game if n > 0]
+    if not shots_per_game:
+        return np.ones(1), np.zeros(1), np.zeros(1)
+
+    # by the result of the last shot so far
+    first = shots_per_game[0]
+    p = game_p[first, :first + 1].sum(axis=1).T
+    r = game_r[first, :first + 1].sum(axis=1).T
+    q = game_q[first, :first + 1].sum(axis=1).T
+
+    for n in shots_per_game[1:]:
+        gp, gr, gq = game_p[n, :n + 1], game_r[n, :n + 1], game_q[n, :n + 1]
+        p_total, r_total, q_total = p.sum(axis=0), r.sum(axis=0), q.sum(axis=0)
+        new_p = np.empty((2, p.shape[1] + n))
+        new_r = np.empty_like(new_p)
+        new_q = np.empty_like(new_p)
+        for last in (0, 1):
+            gp_total, gr_total, gq_total = gp[:, :, last].sum(axis=1), gr[:, :, last].sum(axis=1), gq[:, :, last].sum(axis=1)
+            # the cases where this game starts how the last one ended, so there's one less run
+            join_p = sum(np.convolve(p[result], gp[:, result, last]) for result in (0, 1))
+            join_r = sum(np.convolve(r[result], gp[:, result, last]) + np.convolve(p[result], gr[:, result, last])
+                         for result in (0, 1))
+
+            new_p[last] = np.convolve(p_total, gp_total)
+            new_r[last] = np.convolve(r_total, gp_total) + np.convolve(p_total, gr_total) - join_p
+            # (R1 + R2 - J)^2, with J^2 = J
+            new_q[last] = (np.convolve(q_total, gp_total) + 2 * np.convolve(r_total, gr_total)
+                           + np.convolve(p_total, gq_total) + join_p - 2 * join_r)
+        p, r, q = new_p, new_r, new_q
+    return p.sum(axis=0), r.sum(axis=0), q.sum(axis=0)
+
+def get_z_moments(p, r, q):
+    """
+    the chance the season gets a z-score at all (it won't with all makes or all
+    misses), and the mean and sd of the z-score when it does.
+    """
+    shots = len(p) - 1
+    makes = np.arange(shots + 1)
+    stats = wald_wolfowitz.get_streak_stats(makes, shots - makes, np.zeros(shots + 1))
+    usable = stats["variance"] > 0
+    if shots <= 3 or not usable.any():
+        return 0.0, np.nan, np.nan
+
+    expected, variance = stats["expected_streaks"][usable], stats["variance"][usable]
+    p, r, q = p[usable], r[usable], q[usable]
+    p_usable = p.sum()
+    if p_usable <= 0:
+        return 0.0, np.nan, np.nan
+    # the z-score is linear in runs for a given number of makes
+    mean = ((r - p * expected) / np.sqrt(variance)).sum() / p_usable
+    mean_squares = ((q - 2 * expected * r + expected ** 2 * p) / variance).sum() / p_usable
+    return p_usable, mean, np.sqrt(max(mean_squares - mean ** 2, 0))
+
+@instrumentation.timed()
+def exact_season(df, player_type=streaky_players.LukewarmPlayer):
+    """
+    what simulate_lukewarm.SimulateLukewarm.sim_season would give on average
+    over infinitely many seasons. `df` is player-game rows with makes and misses
+    (eg. from get_all_seasons), and every player shoots their actual season FG%
+    in their actual games.
+
+    `player_type` gets called with a player's FG%, so it can be a class (like
+    LukewarmPlayer) or a function, eg. lambda fg: LastFivePlayer(last5, fg).
+
+    returns one row per player:
+      shots:          in the season
+      expected_runs:  average number of runs
+      p_usable:       chance of getting a z-score at all (more than 3 shots,
+                      and not all makes or all misses)
+      expected_z:     average z-score, when there is one
+      z_sd:           sd of the z-score, when there is one
+
+    a player who went 0-for-everything never makes a shot, so never gets a z-score:
+
+    >>> df = pd.DataFrame({"player_id": [1, 1, 2, 2], "game_id": [1, 2, 1, 2],
+    ...                    "makes": [3, 2, 0, 0], "misses": [4, 3, 3, 2]})
+    >>> results = exact_season(df)
+    >>> results.p_usable.round(3).tolist(), results.expected_z.round(3).tolist()
+    ([1.0, 0.0], [0.018, nan])
+    """
+    games = df.groupby(["player_id", "game_id"])[["makes", "misses"]].sum()
+    num_shots = (games.makes + games.misses).astype(np.int64)
+    makes = games.makes.groupby(level="player_id").sum()
+    fg_percentage = makes / num_shots.groupby(level="player_id").sum()
+
+    rows = []
+    for player_id, player_shots in num_shots.groupby(level="player_id"):
+        player = player_type(fg_percentage[player_id])
+        shots_per_game = player_shots.values
+        run_moments = get_run_moments(get_game_distributions(player, shots_per_game.max()))
+        p, r, q = get_season_moments(run_moments, shots_per_game)
+        p_usable, mean, sd = get_z_moments(p, r, q)
+        rows.append((player_id, shots_per_game.sum(), r.sum(), p_usable, mean, sd))
+
+    results = pd.DataFrame(rows, columns=["player_id", "shots", "expected_runs", "p_usable", "expected_z", "z_sd"])
+    return results.set_index("player_id")
+
+def summarize(results):
+    """
+    pools exact_season's players like run_ensemble pools simulated z-scores:
+    the expected number of z-scores per season, and their mean and std.
+    """
+    usable = results[results.p_usable > 0]
+    count = usable.p_usable.sum()
+    mean = (usable.p_usable * usable.expected_z).sum() / count
+    mean_squares = (usable.p_usable * (usable.z_sd ** 2 + usable.expected_z ** 2)).sum() / count
+    return {
+        "count": count,
+        "mean": mean,
+        "std": np.sqrt(mean_squares - mean ** 2),
+    }
@@ -1,76 +1,209 @@
+import concurrent.futures
+import json
+import os
 import re
+import urllib.request
+
 import pandas as pd
 import numpy as np
 
 from streaks_base import StreaksBase
+import rate_limit
+import streak_cache
+import instrumentation
+
+LEGACY_GAME_IDS_FILE = "game_ids.pkl"
 
-from nba_api.stats import endpoints as nba_endpoints
-from nba_api.live.nba.endpoints import playbyplay
+# same endpoint nba_api.live.nba.endpoints.playbyplay uses
+PLAY_BY_PLAY_URL = "https://cdn.nba.com/static/json/liveData/playbyplay/playbyplay_{game_id}.json"
+REQUEST_HEADERS = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
+REQUEST_TIMEOUT = 30 # seconds
+REQUESTS_PER_SECOND = 4
+
+FREE_THROW_COLUMNS = ["game_id", "time", "player_id", "result"]
 
 class FreeThrowStreaks(StreaksBase):
-    def __init__(self):
+    def __init__(self, base_url=PLAY_BY_PLAY_URL, cache_dir="pbp_cache", workers=8,
+                 requests_per_second=REQUESTS_PER_SECOND, retries=4, backoff=1.0):
         self.SEASONS = ["2021-22", "2022-23", "2023-24", "2024-25"]
-        #self.game_ids = None
+        self.game_ids = None
 
-        # getting game id's is really really slow
-        try:
-            self.game_ids = pd.read_pickle("game_ids.pkl")
-        except:
-            self.game_ids = None
+        # base_url can point at a local server for testing
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.rate_limiter = rate_limit.TokenBucket(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+
+    def fetch_game_ids(self):
+        # nba_api is only needed when actually fetching, not for reading the cache
+        from nba_api.stats import endpoints as nba_endpoints
+
+        game_ids = []
+        for s in self.SEASONS:
+            game_ids.extend(
+                nba_endpoints.teamgamelogs.TeamGameLogs(season_nullable=s).get_data_frames()[0]["GAME_ID"]
+            )
+        game_ids_list = list(set(game_ids))
+        print("got game ids")
+        return pd.DataFrame({"GAME_ID": sorted(game_ids_list)})
 
     def get_game_ids(self):
+        # getting game id's is really really slow, so they're cached by season list.
         if self.game_ids is None:
-            game_ids = []
-            for s in self.SEASONS:
-                game_ids.extend(
-                    nba_endpoints.teamgamelogs.TeamGameLogs(season_nullable=s).get_data_frames()[0]["GAME_ID"]
-                )
-            game_ids_list = list(set(game_ids))
-            self.game_ids = pd.Series(sorted(game_ids_list))
-            print("got game ids")
-            self.game_ids.to_pickle("game_ids.pkl")
+            params = {"seasons": self.SEASONS}
+            cached = streak_cache.load("game_ids", params)
+            if cached is None:
+                if os.path.exists(LEGACY_GAME_IDS_FILE):
+                    # game_ids.pkl was built for these same seasons, no need to fetch again
+                    cached = pd.DataFrame({"GAME_ID": pd.read_pickle(LEGACY_GAME_IDS_FILE).values})
+                else:
+                    cached = self.fetch_game_ids()
+                streak_cache.save("game_ids", cached, params)
+            self.game_ids = cached["GAME_ID"]
 
         return self.game_ids
     
     def get_base_dataframe(self):
-        df = pd.DataFrame(columns=["game_id", "time", "player_id", "result"])
+        df = pd.DataFrame(columns=FREE_THROW_COLUMNS)
         return df
     
+    def get_store_filename(self):
+        return "freethrows.csv"
+
+    def get_done_filename(self):
+        # every game that's been fetched, including ones with no free throws
+        return "freethrows_games.txt"
+
     def get_pickle_filename(self):
+        # where the data used to be saved, before the append-only store
         return f"freethrows.pkl"
 
+    def get_done_game_ids(self):
+        try:
+            with open(self.get_done_filename()) as f:
+                return set(line.strip() for line in f if line.strip())
+        except FileNotFoundError:
+            return set()
+
+    def append_game(self, game_id, ft_data):
+        """
+        adds one game's free throws to the end of the store. nothing that's
+        already been saved gets rewritten.
+        """
+        rows = pd.DataFrame({
+            "game_id": game_id,
+            "time": ft_data["timeActual"].values,
+            "player_id": ft_data["personId"].values,
+            "result": ft_data["shotResult"].values,
+        }, columns=FREE_THROW_COLUMNS)
+        write_header = not os.path.exists(self.get_store_filename())
+        rows.to_csv(self.get_store_filename(), mode="a", header=write_header, index=False)
+
+        # only mark the game done once its rows are saved. if we die in between, the game
+        # gets fetched again and the duplicate rows are dropped in get_dataframe().
+        with open(self.get_done_filename(), "a") as f:
+            f.write(f"{game_id}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _import_pickle(self):
+        # one time conversion of the old freethrows.pkl to the append-only store
+        if os.path.exists(self.get_store_filename()) or not os.path.exists(self.get_pickle_filename()):
+            return
+        legacy = pd.read_pickle(self.get_pickle_filename())
+        legacy.to_csv(self.get_store_filename(), index=False)
+        with open(self.get_done_filename(), "a") as f:
+            f.writelines(f"{game_id}\n" for game_id in legacy.game_id.unique())
+
     def get_dataframe(self):
         """
-        try to load the dataframe from disk. if it does not exist, return base dataframe.
+        load the free throws fetched so far. if there aren't any, return base dataframe.
         """
+        self._import_pickle()
         try:
-            dataframe = pd.read_pickle(self.get_pickle_filename())
-            return dataframe
-        except:
+            dataframe = pd.read_csv(self.get_store_filename(), dtype={"game_id": str})
+        except FileNotFoundError:
             print("no saved file, creating")
             return self.get_base_dataframe()
-        
+        # games finish fetching in whatever order, so put them back in game order.
+        dataframe = dataframe.drop_duplicates().sort_values("game_id", kind="stable")
+        return dataframe.reset_index(drop=True)
+
+    def get_game_filename(self, game_id):
+        return os.path.join(self.cache_dir, f"{game_id}.json")
+
+    def fetch_game_json(self, game_id):
+        """
+        raw play by play JSON for a game. every response that parses is saved,
+        so each game only ever gets requested once.
+        """
+        filename = self.get_game_filename(game_id)
+        try:
+            with open(filename) as f:
+                game_json = json.load(f)
+            instrumentation.count("pbp_cache.hits")
+            return game_json
+        except FileNotFoundError:
+            instrumentation.count("pbp_cache.misses")
+        except json.JSONDecodeError:
+            # saved by an older version that didn't check the response first. get it again.
+            instrumentation.count("pbp_cache.bad_files")
+            os.remove(filename)
+
+        def request():
+            with instrumentation.stage("rate_limit_wait"):
+                self.rate_limiter.acquire()
+            instrumentation.count("pbp_requests")
+            url = self.base_url.format(game_id=game_id)
+            with instrumentation.stage("request"):
+                with urllib.request.urlopen(urllib.request.Request(url, headers=REQUEST_HEADERS),
+                                            timeout=REQUEST_TIMEOUT) as response:
+                    return response.read()
+        raw = rate_limit.with_retries(request, self.retries, self.backoff)
+        # a bad or cut off response raises here, before anything is saved
+        game_json = json.loads(raw)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        def write(tmp_filename):
+            with open(tmp_filename, "wb") as f:
+                f.write(raw)
+        streak_cache.write_atomic(filename, write)
+        return game_json
+
     def get_freethrow_data(self, game_id):
-        play_by_play = playbyplay.PlayByPlay(game_id=game_id)
-        actions = pd.DataFrame(play_by_play.get_dict()['game']['actions'])
+        actions = pd.DataFrame(self.fetch_game_json(game_id)['game']['actions'])
+        if actions.empty:
+            return pd.DataFrame(columns=["timeActual", "personId", "shotResult"])
         return actions[actions.actionType=="freethrow"].copy()
 
+    @instrumentation.timed("get_freethrow_data")
     def get_data(self):
-        df = self.get_dataframe()
-        game_ids = self.get_game_ids()
-        _loop_counter = 0
-        game_ids = set(df.game_id)
-        for game_id in game_ids:
-            if game_id not in game_ids:
-                ft_data = self.get_freethrow_data(game_id)
-                for counter, row in ft_data.iterrows():
-                    add_data = [game_id, row["timeActual"], row["personId"], row["shotResult"]]
-                    df.loc[len(df)] = add_data
-                df.to_pickle(self.get_pickle_filename())
-                _loop_counter += 1
-                if (_loop_counter % 10) == 0:
-                    print(f"{game_id},",)
-        return df
+        """
+        fetches every game that hasn't been fetched yet, `workers` at a time
+        (but never faster than the rate limit), and returns all the free throws.
+        """
+        self._import_pickle()
+        done = self.get_done_game_ids()
+        game_ids = [game_id for game_id in self.get_game_ids() if game_id not in done]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.get_freethrow_data, game_id): game_id for game_id in game_ids}
+            for counter, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                game_id = futures[future]
+                try:
+                    ft_data = future.result()
+                except Exception as e:
+                    # give up on this one for now, it'll get tried again next time.
+                    print(f"failed to get {game_id}: {e}")
+                    instrumentation.count("pbp_failed_games")
+                    continue
+                with instrumentation.stage("append_game", rows=len(ft_data)):
+                    self.append_game(game_id, ft_data)
+                if (counter % 100) == 0:
+                    print(f"{counter}/{len(game_ids)} games,",)
+        return self.get_dataframe()
     
     def get_data_with_stats(self):
         raw_data = self.get_data()
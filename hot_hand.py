@@ -0,0 +1,227 @@
+"""
+Command line entry point for the batch jobs (cron etc), so they don't need a
+notebook:
+
+    python -m hot_hand build-cache --workers 4
+    python -m hot_hand season 2024 --output 2024.parquet
+    python -m hot_hand career --output careers.csv
+    python -m hot_hand simulate --season 2024 --num-seasons 1000
+    python -m hot_hand simulate --season 2024 --exact
+    python -m hot_hand simulate --player-type last-five --last5 .4,.42,.44,.46,.48,.5
+    python -m hot_hand free-throws
+    python -m hot_hand serve
+
+Everything heavy (pandas, scipy, nba_api...) is imported inside the command
+that needs it, so a command that just reads the cache starts quickly. How long
+startup (including those imports) and the command took is printed to stderr
+at the end.
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import time
+
+_start_time = time.perf_counter()
+
+PLAYER_TYPES = {
+    "lukewarm": "LukewarmPlayer",
+    "normal": "NormalPlayer",
+    "last-five": "LastFivePlayer",
+    "heat-check": "OnlyHeatCheckPlayer",
+    "get-a-bucket": "GetABucketPlayer",
+    "truly-streaky": "TrulyStreakyPlayer",
+}
+
+def write_output(df, output):
+    """
+    saves a dataframe as parquet, csv or pickle (going by the extension), or
+    prints it if there's no output file.
+    """
+    if output is None:
+        print(df)
+    elif output.endswith(".parquet"):
+        df.to_parquet(output)
+    elif output.endswith(".csv"):
+        df.to_csv(output)
+    elif output.endswith(".pkl"):
+        df.to_pickle(output)
+    else:
+        raise ValueError(f"don't know how to write {output}, use .parquet, .csv or .pkl")
+
+def build_cache(args):
+    import season_streaks
+    import shot_store
+
+    if args.ingest:
+        shot_store.ingest(range(args.min_year, args.max_year + 1))
+    season_df = season_streaks.get_all_seasons(args.min_year, args.max_year, workers=args.workers, packed=True)
+    print(f"{len(season_df)} player-games cached")
+
+def season(args):
+    import season_streaks
+
+    year = int(args.season)
+    season_df = season_streaks.get_all_seasons(year, year, packed=args.packed)
+    write_output(season_df, args.output)
+
+def career(args):
+    import season_streaks
+
+    if args.streaming:
+        career_df = season_streaks.get_all_player_streaks_streaming(args.min_year, args.max_year)
+    else:
+        all_seasons = season_streaks.get_all_seasons(args.min_year, args.max_year, workers=args.workers, packed=True)
+        career_df = season_streaks.get_all_player_streaks(all_seasons)
+    write_output(career_df, args.output)
+
+def get_player_type(args):
+    """
+    the player class for --player-type, or for last-five, a function that makes
+    a LastFivePlayer with the --last5 FG%s and the player's FG% as the base rate.
+    """
+    import functools
+
+    import streaky_players
+
+    player_type = getattr(streaky_players, PLAYER_TYPES[args.player_type])
+    if player_type is streaky_players.LastFivePlayer:
+        last5 = [float(fg_pct) for fg_pct in args.last5.split(",")]
+        # partial, not a lambda, so it can be sent to the worker processes
+        return functools.partial(streaky_players.LastFivePlayer, last5)
+    return player_type
+
+def simulate(args):
+    import season_streaks
+    import simulate_lukewarm
+
+    year = int(args.season)
+    season_df = season_streaks.get_all_seasons(year, year, packed=True)
+    player_type = get_player_type(args)
+    summary = {
+        "season": args.season,
+        "player_type": args.player_type,
+    }
+    if args.exact:
+        import exact_runs
+
+        results = exact_runs.summarize(exact_runs.exact_season(season_df, player_type))
+        summary.update({name: float(value) for name, value in results.items()})
+    else:
+        results = simulate_lukewarm.run_ensemble(season_df, player_type, args.num_seasons, args.seed, args.workers)
+        summary.update({
+            "num_seasons": results["num_seasons"],
+            "mean": float(results["mean"]),
+            "std": float(results["std"]),
+            "quantiles": {str(q): float(v) for q, v in results["quantiles"].items()},
+            "season_mean_quantiles": {str(q): float(v) for q, v in results["season_mean_quantiles"].items()},
+        })
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+
+def free_throws(args):
+    import free_throw_streaks
+
+    ft = free_throw_streaks.FreeThrowStreaks(workers=args.workers)
+    write_output(ft.get_data_with_stats(), args.output)
+
+def serve(args):
+    import streak_server
+
+    streak_server.serve(args.host, args.port, args.min_year, args.max_year, args.workers)
+
+def get_year_range(args):
+    # the defaults live in season_streaks, which isn't imported until a command runs
+    import season_streaks
+    return (args.min_year or season_streaks.MIN_SEASON), (args.max_year or season_streaks.MAX_SEASON)
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m hot_hand", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--timing", metavar="FILE",
+                        help="write stage timings and counters (see instrumentation.py) to this JSON file")
+    parser.add_argument("--profile", action="store_true", help="with --timing, also cProfile each stage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_year_range(command):
+        command.add_argument("--min-year", type=int, help="first season (default: season_streaks.MIN_SEASON)")
+        command.add_argument("--max-year", type=int, help="last season (default: season_streaks.MAX_SEASON)")
+
+    command = commands.add_parser("build-cache", help="parse every season that isn't cached yet")
+    add_year_range(command)
+    command.add_argument("--workers", type=int, default=1, help="seasons to parse at once")
+    command.add_argument("--ingest", action="store_true", help="convert the kaggle CSVs to the Parquet store first")
+    command.set_defaults(func=build_cache, imports=["season_streaks", "shot_store"])
+
+    command = commands.add_parser("season", help="player-game streak data for one season")
+    command.add_argument("season")
+    command.add_argument("--output", help="file to save to (.parquet, .csv or .pkl), otherwise it's printed")
+    command.add_argument("--packed", action="store_true", help="keep shots packed (raw_packed instead of raw_data)")
+    command.set_defaults(func=season, imports=["season_streaks"])
+
+    command = commands.add_parser("career", help="career streak data for every player")
+    add_year_range(command)
+    command.add_argument("--output", help="file to save to (.parquet, .csv or .pkl), otherwise it's printed")
+    command.add_argument("--workers", type=int, default=1, help="seasons to parse at once, if they aren't cached")
+    command.add_argument("--streaming", action="store_true",
+                         help="go straight through the shots a chunk at a time, in less memory")
+    command.set_defaults(func=career, imports=["season_streaks"])
+
+    command = commands.add_parser("simulate", help="simulate a season many times with streaky/unstreaky players")
+    command.add_argument("--season", default="2024")
+    command.add_argument("--player-type", choices=sorted(PLAYER_TYPES), default="lukewarm")
+    command.add_argument("--last5", help="for last-five: FG%% after 0, 1, ... 5 makes in the last 5 shots, "
+                                         "comma separated (the player's FG%% is used until they've taken 5)")
+    command.add_argument("--num-seasons", type=int, default=1000)
+    command.add_argument("--seed", type=int, default=2718)
+    command.add_argument("--workers", type=int, default=None, help="processes to use (default: one per CPU)")
+    command.add_argument("--exact", action="store_true",
+                         help="work out the average z-scores exactly (see exact_runs.py) instead of simulating")
+    command.add_argument("--output", help="JSON file to save the summary to, otherwise it's printed")
+    command.set_defaults(func=simulate, imports=["season_streaks", "simulate_lukewarm"])
+
+    command = commands.add_parser("free-throws", help="fetch any new free throws, and get streak data for them")
+    command.add_argument("--workers", type=int, default=8, help="requests to have going at once")
+    command.add_argument("--output", help="file to save to (.parquet, .csv or .pkl), otherwise it's printed")
+    command.set_defaults(func=free_throws, imports=["free_throw_streaks"])
+
+    command = commands.add_parser("serve", help="keep the season and career tables in memory, and answer queries")
+    add_year_range(command)
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8765)
+    command.add_argument("--workers", type=int, default=1, help="seasons to parse at once, if they aren't cached")
+    command.set_defaults(func=serve, imports=["streak_server"])
+    return parser
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if (getattr(args, "player_type", None) == "last-five") and not args.last5:
+        parser.error("--player-type last-five needs --last5")
+    if getattr(args, "last5", None) and len(args.last5.split(",")) != 6:
+        parser.error("--last5 needs 6 FG%s, for 0 through 5 makes")
+    if hasattr(args, "min_year"):
+        args.min_year, args.max_year = get_year_range(args)
+
+    if args.timing:
+        import instrumentation
+        instrumentation.enable(profile=args.profile)
+
+    # startup includes importing whatever the command needs
+    for module in args.imports:
+        importlib.import_module(module)
+    startup_time = time.perf_counter() - _start_time
+    command_start = time.perf_counter()
+    args.func(args)
+    command_time = time.perf_counter() - command_start
+
+    if args.timing:
+        instrumentation.dump(args.timing)
+    print(f"startup {startup_time:.3f}s, {args.command} {command_time:.3f}s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
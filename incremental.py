@@ -0,0 +1,96 @@
+"""
+Nightly updates during a live season. Instead of recomputing a whole season (and
+every career) from scratch, only the shots since the last run get summarized, and
+those get merged into the existing player-game and career rows.
+
+Merging two stretches of shots is just adding up makes, misses and runs, minus one
+run if the last shot of the first stretch and the first shot of the second one
+were both makes (or both misses), since that run got counted twice.
+"""
+
+import pandas as pd
+
+import season_streaks
+import streak_converter
+import streaks_base
+
+SUMMARY_COLUMNS = ["player_name", "makes", "misses", "total_streaks", "raw_data", "raw_packed",
+                   "first_made", "last_made"]
+
+def summarize_new_shots(new_shots, packed=False):
+    """
+    player-game summaries of the shots since the last run, in kaggle format.
+    """
+    return season_streaks.summarize_player_games(season_streaks.fix_index(new_shots), packed)
+
+def merge_rows(old_rows, new_rows):
+    """
+    combines rows of makes/misses/runs where `new_rows` continue where `old_rows`
+    left off (matched up by position).
+    """
+    joined = old_rows["last_made"].values == new_rows["first_made"].values
+
+    merged = pd.DataFrame({
+        "player_name": old_rows["player_name"].values,
+        "makes": old_rows["makes"].values + new_rows["makes"].values,
+        "misses": old_rows["misses"].values + new_rows["misses"].values,
+        "total_streaks": old_rows["total_streaks"].values + new_rows["total_streaks"].values - joined,
+        "first_made": old_rows["first_made"].values,
+        "last_made": new_rows["last_made"].values,
+    }, index=old_rows.index)
+
+    if ("raw_data" in old_rows) and ("raw_data" in new_rows):
+        merged["raw_data"] = old_rows["raw_data"].values + new_rows["raw_data"].values
+    if ("raw_packed" in old_rows) and ("raw_packed" in new_rows):
+        # as an object Series, so it still works when there are no rows to merge
+        merged["raw_packed"] = pd.Series(streak_converter.join_packed(
+            old_rows["raw_packed"].values, streak_converter.get_lengths(old_rows),
+            new_rows["raw_packed"].values, streak_converter.get_lengths(new_rows)),
+            index=old_rows.index, dtype=object)
+    return merged
+
+def _merge_into(df, updates, add_stats):
+    """
+    merges `updates` (indexed the same way as `df`) into `df`, and recomputes
+    stats for just the rows that changed.
+    """
+    df = streak_converter.add_boundaries(df)
+    columns = [c for c in SUMMARY_COLUMNS if c in df]
+
+    continuing = updates.index.isin(df.index)
+    continued = merge_rows(df.loc[updates.index[continuing]], updates[continuing])
+    changed = pd.concat([continued, updates[~continuing]])
+    changed = add_stats(changed[columns].copy())
+
+    unchanged = df[~df.index.isin(changed.index)]
+    return pd.concat([unchanged, changed[df.columns]])
+
+def update_season(season_df, new_shots, season, do_percentile_rank=True):
+    """
+    adds the shots since the last run to a season's player-game data (from
+    get_streaks_for_season). only player-games with new shots get recomputed.
+
+    returns the updated season, and the summaries of just the new shots, which
+    update_careers() needs.
+    """
+    new_games = summarize_new_shots(new_shots, packed="raw_packed" in season_df)
+    if len(new_games) == 0:
+        # no games since the last run
+        return season_df, new_games
+    updated = _merge_into(season_df, new_games,
+                          lambda df: season_streaks.add_streak_stats(df, season, do_percentile_rank))
+    return updated.sort_index(), new_games
+
+def update_careers(career_df, new_games):
+    """
+    adds new player-game summaries (from update_season) onto career data
+    (from get_all_player_streaks). only the players with new shots get recomputed.
+    """
+    if len(new_games) == 0:
+        return career_df
+    streak_helper = streaks_base.StreaksBase()
+    new_by_player = streak_converter.combine_summaries(new_games, "player_id",
+                                                       need_raw_data=("raw_data" in career_df) or ("raw_packed" in career_df))
+
+    updated = _merge_into(career_df.set_index("player_id"), new_by_player, streak_helper.calc_stats)
+    return updated.reset_index()
@@ -0,0 +1,185 @@
+"""
+Stage timers and counters for finding out where a slow run spends its time.
+Everything is off by default, and then stage() and count() do next to nothing,
+so they can stay in the code for good.
+
+    import instrumentation
+    instrumentation.enable()
+    season_streaks.get_all_seasons()
+    instrumentation.dump("timings.json")
+
+enable(profile=True) also runs each top-level stage under cProfile. Setting
+the HOT_HAND_TIMING environment variable turns it on without changing any code.
+"""
+
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+_enabled = False
+_profile = False
+
+# name -> {"calls", "seconds", "rows"}
+_stages = collections.defaultdict(lambda: {"calls": 0, "seconds": 0.0, "rows": 0})
+_counters = collections.Counter()
+_profiles = {}
+# name -> function returning a dict of stats, for caches that keep their own (eg. lru_cache)
+_cache_stats = {}
+# stages can run in threads (eg. free throw fetching), so each thread has its own nesting
+_local = threading.local()
+_lock = threading.Lock()
+
+_NOT_TIMING = contextlib.nullcontext()
+
+def enable(profile=False):
+    global _enabled, _profile
+    _enabled = True
+    _profile = profile
+
+def disable():
+    global _enabled, _profile
+    _enabled = False
+    _profile = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+    _profiles.clear()
+
+def stage(name, rows=None):
+    """
+    times a block of code under `name`:
+
+        with instrumentation.stage("season.parse", rows=len(shots)):
+            ...
+
+    stages inside other stages get the outer stage's name as a prefix, eg.
+    "get_all_seasons/season.parse". `rows` is added up over every call.
+    """
+    if not _enabled:
+        return _NOT_TIMING
+    return _timed_stage(name, rows)
+
+def _get_active_stages():
+    if not hasattr(_local, "active_stages"):
+        _local.active_stages = []
+    return _local.active_stages
+
+@contextlib.contextmanager
+def _timed_stage(name, rows):
+    active_stages = _get_active_stages()
+    full_name = "/".join(active_stages + [name])
+    # only one profiler can run at a time, so only the outermost stage (in the
+    # main thread) gets one
+    profiler = None
+    if _profile and not active_stages and (threading.current_thread() is threading.main_thread()):
+        profiler = cProfile.Profile()
+
+    active_stages.append(name)
+    start_time = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        if profiler:
+            profiler.disable()
+            if full_name in _profiles:
+                _profiles[full_name].add(profiler)
+            else:
+                _profiles[full_name] = pstats.Stats(profiler)
+        active_stages.pop()
+
+        with _lock:
+            stats = _stages[full_name]
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+            if rows is not None:
+                stats["rows"] += int(rows)
+
+def timed(name=None):
+    """
+    decorator version of stage(), named after the function by default.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _timed_stage(stage_name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """
+    adds n to a counter, eg. count("streak_cache.hits").
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+def register_cache(name, get_stats):
+    """
+    includes a cache's own stats in the report. `get_stats` returns a dict.
+    """
+    _cache_stats[name] = get_stats
+
+def get_profile_text(name, limit=20):
+    stream = io.StringIO()
+    stats = _profiles[name]
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+def report(profile_limit=20):
+    """
+    everything recorded so far, as a dict that can be dumped as JSON.
+    """
+    stages = {}
+    for name, stats in _stages.items():
+        stages[name] = {"calls": stats["calls"], "seconds": stats["seconds"]}
+        if stats["rows"]:
+            stages[name]["rows"] = stats["rows"]
+            stages[name]["rows_per_second"] = stats["rows"] / stats["seconds"]
+
+    return {
+        "stages": stages,
+        "counters": dict(_counters),
+        "caches": {name: get_stats() for name, get_stats in _cache_stats.items()},
+        "profiles": {name: get_profile_text(name, profile_limit) for name in _profiles},
+    }
+
+def dump(filename=None, profile_limit=20):
+    """
+    writes report() as JSON to `filename`, or returns it as a string.
+    """
+    as_json = json.dumps(report(profile_limit), indent=2, default=str)
+    if filename is None:
+        return as_json
+    with open(filename, "w") as f:
+        f.write(as_json)
+
+def dump_profiles(directory):
+    """
+    saves each stage's profile as a .prof file (for snakeviz etc).
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, stats in _profiles.items():
+        stats.dump_stats(os.path.join(directory, name.replace("/", "__") + ".prof"))
+
+if os.environ.get("HOT_HAND_TIMING"):
+    enable(profile=os.environ["HOT_HAND_TIMING"] == "profile")
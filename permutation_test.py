@@ -0,0 +1,166 @@
+"""
+Permutation test for streakiness over a whole season or career, as an
+alternative to the Wald-Wolfowitz approximation.
+
+Wald-Wolfowitz treats a player's shots as one long sequence that could have
+come in any order. But a career is a bunch of games glued together, and how
+many shots a player makes varies from game to game, so a better null is that
+the shots *within each game* could have come in any order. Here each player's
+games get shuffled thousands of times, and the observed number of runs is
+compared to the number of runs in the shuffles.
+
+All the shuffles for a batch of players are done at once: every shot gets a
+random key, and sorting by (game, key) shuffles every game independently.
+"""
+
+import numpy as np
+import pandas as pd
+
+import streak_converter
+import instrumentation
+
+NUM_PERMUTATIONS = 1000
+
+# most elements (shots x permutations) to have in memory at once. the sort
+# needs a few arrays this size, so 4M is around 100 MB.
+CHUNK_SIZE = 4_000_000
+
+# players are shuffled together in batches of about this many shots
+BATCH_SHOTS = 20_000
+
+def get_player_shots(player_games):
+    """
+    puts each player's games end to end, like get_all_player_streaks does.
+    takes player-game rows (eg. from get_all_seasons) with raw_data or raw_packed.
+
+    returns the per-player rows (in player_id order), plus a boolean array of
+    every shot, and the number of shots in each game.
+    """
+    player_games = player_games.reset_index()
+    order_by = [column for column in ["player_id", "season", "game_id"] if column in player_games]
+    player_games = player_games.sort_values(by=order_by, kind="stable").reset_index(drop=True)
+
+    game_lengths = streak_converter.get_lengths(player_games)
+    if "raw_packed" in player_games:
+        made = streak_converter.unpack_groups(player_games["raw_packed"].values, game_lengths)
+    else:
+        made = streak_converter.to_made_array("".join(player_games["raw_data"]))
+    return player_games, made, game_lengths
+
+def count_runs(made, player_starts):
+    """
+    number of runs for each player, for a 2d array of shot results (one row per
+    permutation). `player_starts` is the column where each player's shots begin.
+    """
+    run_starts = np.ones(made.shape, dtype=np.int32)
+    run_starts[:, 1:] = made[:, 1:] != made[:, :-1]
+    run_starts[:, player_starts] = 1
+    return np.add.reduceat(run_starts, player_starts, axis=1)
+
+def shuffle_within_games(made, game_ids, num_permutations, rng):
+    """
+    `num_permutations` copies of `made`, each with the shots in every game shuffled.
+    game_ids must be sorted (each game's shots contiguous).
+    """
+    keys = rng.integers(0, 2**31, size=(num_permutations, len(made)), dtype=np.int64)
+    # sort by game first, then the random key
+    keys |= game_ids.astype(np.int64) << 31
+    return made[keys.argsort(axis=1)]
+
+def get_permuted_runs(made, game_lengths, player_lengths, num_permutations=NUM_PERMUTATIONS,
+                      rng=None, chunk_size=CHUNK_SIZE):
+    """
+    number of runs for each player in each of `num_permutations` within-game
+    shuffles. returns an array of shape (num_permutations, players).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    game_ids = np.repeat(np.arange(len(game_lengths)), game_lengths)
+    player_starts = np.concatenate([[0], np.cumsum(player_lengths)[:-1]]).astype(np.int64)
+
+    per_pass = max(1, chunk_size // max(len(made), 1))
+    all_runs = []
+    for start in range(0, num_permutations, per_pass):
+        shuffled = shuffle_within_games(made, game_ids, min(per_pass, num_permutations - start), rng)
+        all_runs.append(count_runs(shuffled, player_starts))
+    return np.concatenate(all_runs)
+
+def _get_batches(player_lengths, batch_shots):
+    """
+    splits players into consecutive batches of about batch_shots shots each.
+    """
+    batch_ids = np.cumsum(player_lengths) // batch_shots
+    return np.flatnonzero(np.diff(batch_ids, prepend=-1))
+
+@instrumentation.timed()
+def permutation_test(player_games, num_permutations=NUM_PERMUTATIONS, seed=None,
+                     chunk_size=CHUNK_SIZE, batch_shots=BATCH_SHOTS):
+    """
+    within-game permutation test for every player in `player_games` (rows of
+    player-games, with raw_data or raw_packed, eg. from get_streaks_for_season
+    or get_all_seasons).
+
+    returns one row per player, with the observed number of runs, the mean and
+    sd of the number of runs over the shuffles, and:
+      z_score:  (observed - mean) / sd
+      p_fewer:  how likely this few runs (or fewer) is under the null. small
+                means streaky.
+      p_more:   same, for this many runs or more. small means anti-streaky.
+      p_value:  two-sided
+
+    the p-values count the observed sequence as one of the permutations, so they're
+    never 0. the same seed, chunk_size and batch_shots give the same results.
+    """
+    player_games, made, game_lengths = get_player_shots(player_games)
+
+    new_player = np.ones(len(player_games), dtype=bool)
+    new_player[1:] = player_games["player_id"].values[1:] != player_games["player_id"].values[:-1]
+    player_first_game = np.flatnonzero(new_player)
+    player_lengths = np.add.reduceat(game_lengths, player_first_game)
+
+    # shot/game offsets of each player
+    shot_offsets = np.concatenate([[0], np.cumsum(player_lengths)])
+    game_offsets = np.append(player_first_game, len(player_games))
+
+    observed = count_runs(made[None, :], shot_offsets[:-1])[0]
+
+    batch_starts = _get_batches(player_lengths, batch_shots)
+    batch_ends = np.append(batch_starts[1:], len(player_lengths))
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(batch_starts))]
+
+    permuted_mean = np.empty(len(player_lengths))
+    permuted_sd = np.empty(len(player_lengths))
+    num_fewer = np.empty(len(player_lengths), dtype=np.int64)
+    num_more = np.empty(len(player_lengths), dtype=np.int64)
+
+    for first, last, rng in zip(batch_starts, batch_ends, rngs):
+        shots = slice(shot_offsets[first], shot_offsets[last])
+        games = slice(game_offsets[first], game_offsets[last])
+        with instrumentation.stage("shuffle", rows=num_permutations * (shots.stop - shots.start)):
+            permuted = get_permuted_runs(made[shots], game_lengths[games], player_lengths[first:last],
+                                         num_permutations, rng, chunk_size)
+        batch_observed = observed[first:last]
+        permuted_mean[first:last] = permuted.mean(axis=0)
+        permuted_sd[first:last] = permuted.std(axis=0)
+        num_fewer[first:last] = (permuted <= batch_observed).sum(axis=0)
+        num_more[first:last] = (permuted >= batch_observed).sum(axis=0)
+
+    first_rows = player_games.iloc[player_first_game]
+    results = pd.DataFrame({
+        "player_id": first_rows["player_id"].values,
+        "makes": np.add.reduceat(player_games["makes"].values, player_first_game),
+        "misses": np.add.reduceat(player_games["misses"].values, player_first_game),
+        "total_streaks": observed,
+        "permuted_mean": permuted_mean,
+        "permuted_sd": permuted_sd,
+    })
+    if "player_name" in player_games:
+        results.insert(1, "player_name", first_rows["player_name"].values)
+
+    # if every shuffle has the same number of runs (eg. every game is all makes), there's no z-score
+    with np.errstate(divide="ignore", invalid="ignore"):
+        results["z_score"] = np.where(permuted_sd > 0, (observed - permuted_mean) / permuted_sd, np.nan)
+    results["p_fewer"] = (num_fewer + 1) / (num_permutations + 1)
+    results["p_more"] = (num_more + 1) / (num_permutations + 1)
+    results["p_value"] = np.minimum(1.0, 2 * np.minimum(results["p_fewer"], results["p_more"]))
+    return results.set_index("player_id")
@@ -1,13 +1,13 @@
+import json
+import os
 import re
-import time
 
 import pandas as pd
 import numpy as np
 
 from streaks_base import StreaksBase
-
-from nba_api.stats.static import players
-from nba_api.stats.endpoints import shotchartdetail
+import rate_limit
+import streak_cache
 
 PLAYER_STREAK_FILE = "player_streaks.pkl"
 SLEEP_TIME = 2 #seconds between API requests
@@ -34,10 +34,15 @@ class PlayerStreaks(StreaksBase):
         This should return a dict() of id to player name 
         for all active players in the current season.
         """
+        # nba_api is only needed when actually fetching, not for reading the pickle
+        from nba_api.stats.static import players
+
         all_active =  players.get_active_players()
         return dict((x['id'], x['full_name']) for x in all_active)
 
     def get_shots_for_player_id(self, player_id):
+        from nba_api.stats.endpoints import shotchartdetail
+
         response = shotchartdetail.ShotChartDetail(
             team_id = 0,
             player_id = player_id,
@@ -59,40 +64,97 @@ class PlayerStreaks(StreaksBase):
     def get_pickle_filename(self):
         return f"{self.season}_{self.shot_type}_{PLAYER_STREAK_FILE}"
 
+    def get_log_filename(self):
+        # players fetched since the pickle was last written, one JSON record per line
+        return f"{self.get_pickle_filename()}.log"
+
+    def append_to_log(self, record):
+        with open(self.get_log_filename(), "a+b") as f:
+            # if the last write got cut off partway, start a new line instead of
+            # tacking this record onto the torn one
+            line = (json.dumps(record) + "\n").encode()
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_log(self):
+        records = []
+        try:
+            with open(self.get_log_filename()) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # a partly written line, from getting killed mid-write.
+                        # that player just gets fetched again.
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
+
     def get_dataframe(self):
         """
-        try to load the dataframe from disk. if it does not exist, return base dataframe.
+        try to load the dataframe from disk, plus anything in the log.
+        if neither exists, return base dataframe.
         """
         try:
             dataframe = pd.read_pickle(self.get_pickle_filename())
-            return dataframe
-        except:
+        except FileNotFoundError:
             print("no saved file, creating")
-            return self.get_stats_dataframe()
+            dataframe = self.get_stats_dataframe()
+
+        records = self.read_log()
+        if records:
+            logged = pd.DataFrame(records).set_index("player_id")
+            dataframe = pd.concat([dataframe, logged[dataframe.columns]])
+            dataframe = dataframe[~dataframe.index.duplicated(keep="last")].infer_objects()
+        return dataframe
 
+    def compact(self):
+        """
+        folds the log into the pickle, and starts a new log.
+        """
+        df = self.get_dataframe()
+        streak_cache.write_atomic(self.get_pickle_filename(), df.to_pickle)
+        if os.path.exists(self.get_log_filename()):
+            os.remove(self.get_log_filename())
+        return df
 
     def get_data(self):
         """
         this will return streak data for all NBA players for the current season.
+
+        each player gets appended to a log as soon as they're fetched, so if this
+        gets interrupted it picks up where it left off. the log gets folded into
+        the pickle at the end.
         """
         df = self.get_dataframe()
+        rate_limiter = rate_limit.TokenBucket(1 / SLEEP_TIME)
 
         player_ids = self.get_all_player_ids()
         for player_id, player_name in player_ids.items():
             ## see if we've already done this row.
             ## once we have all the data, this shouldn't fire any additional requests
             if player_id not in df.index:
+                # only waits for whatever's left of SLEEP_TIME since the last request
+                rate_limiter.acquire()
                 player_data = self.get_shots_for_player_id(player_id)
                 streak_data = self.convert_to_streaks(player_data)
-                df.loc[player_id] = [player_name, streak_data['makes'], streak_data['misses'],
-                                    streak_data['total_streaks'], streak_data['raw_data']
-                                    ]
+                self.append_to_log({
+                    "player_id": int(player_id),
+                    "player_name": player_name,
+                    "makes": streak_data['makes'],
+                    "misses": streak_data['misses'],
+                    "total_streaks": streak_data['total_streaks'],
+                    "raw_data": streak_data['raw_data'],
+                })
                 print(f"{player_id}, ",)
-                # save after every iteration
-                df.to_pickle(self.get_pickle_filename())
-                time.sleep(SLEEP_TIME)
 
-        return df
+        return self.compact()
     
     def get_data_with_stats(self):
         df = self.get_data()
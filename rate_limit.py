@@ -0,0 +1,84 @@
+import http.client
+import random
+import threading
+import time
+import urllib.error
+
+class TokenBucket:
+    """
+    rate limiter for API requests, safe to share between threads.
+    allows `rate` requests per second on average, with bursts of up to `burst`.
+
+    only waits for however much of the budget is left, so time spent on the
+    request itself counts towards the gap between requests.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + ((now - self.last_update) * self.rate))
+            self.last_update = now
+            # take a token even if there isn't one yet. anyone after us
+            # has to wait for it to be paid back.
+            self.tokens -= 1
+            wait_time = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+def is_transient(error):
+    """
+    whether a failed request is worth trying again: network trouble, timeouts,
+    rate limiting (429) and server errors (5xx). anything else (a 404 for a game
+    with no play by play, a bug on our end) will just fail the same way again.
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        return (error.code == 429) or (error.code >= 500)
+    return isinstance(error, (urllib.error.URLError, TimeoutError, ConnectionError, http.client.IncompleteRead))
+
+def with_retries(request, retries=4, backoff=1.0, should_retry=is_transient):
+    """
+    calls request(), retrying with exponential backoff (plus some jitter) if it
+    raises an error that should_retry(error) says is worth retrying. anything
+    else, or the last error if every try fails, is re-raised.
+
+    eg. against a local stub server that fails twice, then works:
+
+    >>> import http.server, urllib.request
+    >>> responses = [503, 429, 200, 404]
+    >>> class Stub(http.server.BaseHTTPRequestHandler):
+    ...     def do_GET(self):
+    ...         self.send_response(responses.pop(0))
+    ...         self.end_headers()
+    ...         self.wfile.write(b"ok")
+    ...     def log_message(self, *args):
+    ...         pass
+    >>> server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+    >>> def request():
+    ...     with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/") as response:
+    ...         return response.read()
+    >>> with_retries(request, backoff=0)
+    b'ok'
+    >>> with_retries(request, backoff=0)
+    Traceback (most recent call last):
+    ...
+    urllib.error.HTTPError: HTTP Error 404: Not Found
+    >>> responses
+    []
+    >>> server.shutdown()
+    """
+    for attempt in range(retries + 1):
+        try:
+            return request()
+        except Exception as e:
+            if (attempt == retries) or not should_retry(e):
+                raise
+            time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
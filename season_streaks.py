@@ -1,182 +1,374 @@
+import concurrent.futures
+import os
+import time
+
 import pandas as pd
 import numpy as np
 
 import wald_wolfowitz
 import streak_converter
 import streaks_base
-import scipy.stats
+import shot_store
+import streak_cache
+import instrumentation
 
 # Data from https://www.kaggle.com/datasets/mexwell/nba-shots
 MIN_SEASON=2004
 MAX_SEASON=2024
 
+# bump this when a change to get_streaks_for_season changes its output, so the
+# cached seasons get rebuilt.
+STREAKS_VERSION = 3
+
+# shots per chunk when streaming through all the seasons (see iter_shot_chunks)
+CHUNK_SIZE = 250_000
+STREAM_COLUMNS = shot_store.STREAK_COLUMNS + ["SORTABLE_DATE"]
+
 def fix_index(shots):
     """
     the shot data from kaggle is not (always) in chronological order. furthermore,
     the NBA game ID cannot be used for sorting. it's roughly chronological but not always. 
     """
 
-    shots["SORTABLE_DATE"] = pd.to_datetime(shots.GAME_DATE)
-    shots = shots.sort_values(by=["SEASON_1", "SORTABLE_DATE", "QUARTER", "MINS_LEFT", "SECS_LEFT"], 
-                                ascending=[True, True,True,False,False]).reset_index(drop=True)
+    with instrumentation.stage("fix_index", rows=len(shots)):
+        shots["SORTABLE_DATE"] = pd.to_datetime(shots.GAME_DATE)
+        shots = shots.sort_values(by=["SEASON_1", "SORTABLE_DATE", "QUARTER", "MINS_LEFT", "SECS_LEFT"], 
+                                    ascending=[True, True,True,False,False]).reset_index(drop=True)
+    return shots
+
+def get_season_shots(season, columns=None):
+    """
+    one season of shots in chronological order. uses the Parquet store (see shot_store.py)
+    if that season has been ingested, otherwise parses the kaggle CSV.
+    """
+    if shot_store.has_season(season):
+        with instrumentation.stage("read_store"):
+            return shot_store.read_season(season, columns)
+    with instrumentation.stage("read_csv"):
+        shots = pd.read_csv(shot_store.get_csv_filename(season))
+    shots = fix_index(shots)
+    if columns is not None:
+        shots = shots[columns]
     return shots
 
-def get_all_shots():
+def get_all_shots(columns=None):
+    """
+    every shot from MIN_SEASON to MAX_SEASON in chronological order.
+    `columns` limits the columns that get loaded. iter_shot_chunks does the
+    same thing without loading it all at once.
+    """
+    seasons = range(MIN_SEASON, MAX_SEASON+1)
+    if all(shot_store.has_season(season) for season in seasons):
+        return shot_store.read_seasons(seasons, columns)
+
     all_shots = []
-    for season in range(MIN_SEASON, MAX_SEASON+1):
-        shots =  pd.read_csv(f"kaggle_data/NBA_{season}_Shots.csv")
-        all_shots.append(fix_index(shots))
-    # to make the index unique after concatting them, need to redo it 
-    # (there may be a more natural way of doing this)
-    concated = pd.concat(all_shots)
-    return fix_index(concated)
+    for season in seasons:
+        all_shots.append(get_season_shots(season, columns))
+    # each season is sorted already, so stacking them up in order keeps
+    # everything chronological, and ignore_index makes the index unique.
+    return pd.concat(all_shots, ignore_index=True)
 
-def get_streaks_for_season(season, do_percentile_rank=True, shots=None):
+def iter_shot_chunks(min_year=MIN_SEASON, max_year=MAX_SEASON, chunk_size=CHUNK_SIZE,
+                     columns=STREAM_COLUMNS):
     """
-    this gets player-game level streakiness data for a single season of the NBA.
+    every shot from min_year to max_year in chronological order, as
+    (season, shots) pairs of about `chunk_size` shots, for going through the
+    whole history without having all of it in memory.
+
+    a chunk never splits a game (or a season): shots from the last date in a
+    chunk are held back and go out at the start of the next one. `columns`
+    needs to include SORTABLE_DATE for that.
+
+    seasons in the Parquet store are read a piece at a time. ones that aren't
+    get parsed from the CSV whole, and then split up.
     """
-    if shots is None:
-        shots =  pd.read_csv(f"kaggle_data/NBA_{season}_Shots.csv")
-    # I didn't realize the NBA was returning shots
-    # in reverse order. this wouldn't change the number of streaks, or number 
-    # of makes/misses, but raw_data field would be backwards.
-    shots = fix_index(shots)
+    for season in range(min_year, max_year + 1):
+        if shot_store.has_season(season):
+            batches = shot_store.iter_season_batches(season, columns, chunk_size)
+        else:
+            season_shots = get_season_shots(season, columns)
+            batches = (season_shots.iloc[start:start + chunk_size]
+                       for start in range(0, len(season_shots), chunk_size))
 
-    combined_df = pd.DataFrame(columns=["player_id", "game_id", "player_name", "makes", 
-                                    "misses", "total_streaks", "raw_data"])
-    combined_df = combined_df.set_index(["player_id", "game_id"])
+        held_back = None
+        for batch in batches:
+            if held_back is not None:
+                batch = pd.concat([held_back, batch], ignore_index=True)
+            dates = batch["SORTABLE_DATE"].values
+            last_date_start = np.searchsorted(dates, dates[-1], side="left")
+            held_back = batch.iloc[last_date_start:]
+            if last_date_start > 0:
+                yield str(season), batch.iloc[:last_date_start]
 
+        if (held_back is not None) and len(held_back):
+            yield str(season), held_back
 
-    for key, results in shots.groupby(["PLAYER_ID", "GAME_ID"]):
-        streak_data = "".join(results["SHOT_MADE"].replace(True, "W").replace(False, "L"))
-        as_streaks = streak_converter.convert_to_streaks(False, streak_data)
+def summarize_player_games(shots, packed=False):
+    """
+    makes, misses, runs and raw_data for every player-game in `shots`, which
+    should already be in chronological order (see fix_index).
+    this is done in one pass over the whole season instead of one group at a time.
 
-        combined_df.loc[key, :] = [results["PLAYER_NAME"].iloc[0], as_streaks['makes'], as_streaks['misses'],
-                                    as_streaks['total_streaks'], as_streaks['raw_data']]
+    with packed set, the shots are stored as bytes in raw_packed instead of
+    "W"/"L" strings in raw_data (see streak_converter.pack).
+    """
+    # stable sort, so shots stay in chronological order within each player-game
+    shots = shots.sort_values(by=["PLAYER_ID", "GAME_ID"], kind="stable")
+    player_ids = shots["PLAYER_ID"].values
+    game_ids = shots["GAME_ID"].values
+    made = shots["SHOT_MADE"].values.astype(bool)
 
-    combined_df['expected_streaks'] = wald_wolfowitz.get_expected_streaks(combined_df.makes, combined_df.misses)
+    new_group = np.ones(len(shots), dtype=bool)
+    new_group[1:] = (player_ids[1:] != player_ids[:-1]) | (game_ids[1:] != game_ids[:-1])
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], len(shots))
 
-    # to calculate variance > 0, expected streaks needs to be more than 2 (which makes sense)
-    # makes + misses needs to be > 1.
-    can_calc = ((combined_df.makes + combined_df.misses) > 1) & (combined_df.expected_streaks > 2)
-    calc_df = combined_df[can_calc].copy()
-    uncalc_df = combined_df[~can_calc].copy()
+    summary = streak_converter.summarize_groups(made, group_starts)
 
-    calc_df['variance'] = wald_wolfowitz.get_variance(calc_df.makes, 
-                                                        calc_df.misses, 
-                                                        calc_df.expected_streaks)
-    calc_df['z_score'] = (calc_df.total_streaks - calc_df.expected_streaks) / ((calc_df.variance)**.5)
-    
-    uncalc_df['variance'] = np.nan
-    uncalc_df['z_score'] = np.nan
+    combined_df = pd.DataFrame({
+        "player_id": player_ids[group_starts],
+        "game_id": game_ids[group_starts],
+        "player_name": shots["PLAYER_NAME"].values[group_starts],
+        "makes": summary['makes'],
+        "misses": summary['misses'],
+        "total_streaks": summary['total_streaks'],
+        # first/last shot of the game, so runs can be added up across games
+        # without needing raw_data
+        "first_made": summary['first'],
+        "last_made": summary['last'],
+    })
+    if packed:
+        combined_df.insert(6, "raw_packed", streak_converter.pack_groups(made, group_starts))
+    else:
+        as_str = streak_converter.to_str(made)
+        combined_df.insert(6, "raw_data", [as_str[start:end] for start, end in zip(group_starts, group_ends)])
+    return combined_df.set_index(["player_id", "game_id"])
 
-    clean_df = pd.concat([calc_df, uncalc_df])
-    clean_df['season'] = season
+@instrumentation.timed()
+def get_streaks_for_season(season, do_percentile_rank=True, shots=None, packed=False):
+    """
+    this gets player-game level streakiness data for a single season of the NBA.
+    """
+    if shots is None:
+        shots = get_season_shots(season, shot_store.STREAK_COLUMNS)
+    else:
+        # I didn't realize the NBA was returning shots
+        # in reverse order. this wouldn't change the number of streaks, or number 
+        # of makes/misses, but raw_data field would be backwards.
+        shots = fix_index(shots)
 
-    clean_df['ww_percentile'] = 100 * scipy.stats.norm.cdf(clean_df.z_score.tolist())
+    with instrumentation.stage("summarize_player_games", rows=len(shots)):
+        combined_df = summarize_player_games(shots, packed)
+    return add_streak_stats(combined_df, season, do_percentile_rank)
+
+@instrumentation.timed()
+def add_streak_stats(combined_df, season, do_percentile_rank=True, method="normal"):
+    """
+    adds the Wald-Wolfowitz stats to player-game rows from summarize_player_games.
+    see wald_wolfowitz.get_streak_stats for `method`.
+    """
+    clean_df = combined_df.copy()
+    # variance and z_score are NaN for games where they can't be calculated
+    # (1 shot, or all makes/all misses).
+    stats = wald_wolfowitz.get_streak_stats(clean_df.makes, clean_df.misses, clean_df.total_streaks, method)
+    clean_df['expected_streaks'] = stats['expected_streaks']
+    clean_df['variance'] = stats['variance']
+    clean_df['z_score'] = stats['z_score']
+    clean_df['season'] = season
+    clean_df['ww_percentile'] = stats['ww_percentile']
 
     if do_percentile_rank:
         # may as well calculate percentile ranks while we're here
-        clean_df['exact_percentile_rank'] = None
+        with instrumentation.stage("percentile_ranks", rows=len(clean_df)):
+            clean_df['exact_percentile_rank'] = wald_wolfowitz.get_percentile_ranks(
+                clean_df.makes, clean_df.misses, clean_df.total_streaks)
 
-        for row_id, data in clean_df.iterrows():
-            # I haven't vectorized get_percentile_rank so I have to loop over every row =(
-            clean_df.loc[row_id, "exact_percentile_rank"] = wald_wolfowitz.get_percentile_rank(data['makes'], data['misses'], data['total_streaks'])
-            
-        clean_df['z_from_percentile_rank'] = scipy.stats.norm.ppf(
-            (clean_df['exact_percentile_rank'].values/ 100).tolist())
+        clean_df['z_from_percentile_rank'] = wald_wolfowitz.get_z_from_percentile_ranks(
+            clean_df['exact_percentile_rank'].values)
 
     return clean_df
 
-def get_all_seasons(min_year=MIN_SEASON, max_year=MAX_SEASON):
+def get_season_inputs(season):
+    """
+    the file a season's shots come from, which the season's cache entry depends on.
+    """
+    csv_filename = shot_store.get_csv_filename(season)
+    if os.path.exists(csv_filename):
+        return [csv_filename]
+    return [shot_store.get_store_filename(season)]
+
+def get_season_cache_params(season, do_percentile_rank=True):
+    return {"season": str(season), "do_percentile_rank": do_percentile_rank}
+
+def load_season_cache(season, do_percentile_rank=True, packed=False):
+    """
+    a season's streak data from the cache, or None if it needs to be (re)built.
+
+    seasons are cached with packed shots, which get turned back into raw_data
+    strings unless `packed` is set.
+    """
+    season_df = streak_cache.load(f"{season}-streaks", get_season_cache_params(season, do_percentile_rank),
+                                  get_season_inputs(season), STREAKS_VERSION)
+    if (season_df is not None) and not packed:
+        season_df = streak_converter.unpack_raw_data(season_df)
+    return season_df
+
+def _build_season_cache(season, do_percentile_rank=True):
+    """
+    parses one season and saves it to the streak cache. returns how long it took.
+    this runs in a worker process when get_all_seasons is run in parallel.
+    """
+    start_time = time.perf_counter()
+    season_df = get_streaks_for_season(season, do_percentile_rank, packed=True)
+    with instrumentation.stage("save_cache", rows=len(season_df)):
+        streak_cache.save(f"{season}-streaks", season_df, get_season_cache_params(season, do_percentile_rank),
+                          get_season_inputs(season), STREAKS_VERSION)
+    return season, time.perf_counter() - start_time
+
+@instrumentation.timed()
+def get_all_seasons(min_year=MIN_SEASON, max_year=MAX_SEASON, workers=1, packed=False):
     """
     this gets all player-game streakiness data for a range of seasons.
+    with `packed` set, shots come back as bytes in raw_packed instead of raw_data.
+
+    seasons that aren't in the cache (or whose shot data or code has changed since
+    they were cached) get parsed first. with `workers` > 1 they're parsed in that
+    many processes at once (None means one per CPU).
     """
-    all_seasons = []
-    for x in range(min_year, max_year + 1):
-        season = str(x)
-        pkl_name = f"streak_cache/{season}-streaks.pkl"
-        try:
-            season = pd.read_pickle(pkl_name)
-        except:
-            print(f"parsing {season}")
-            season = get_streaks_for_season(season)
-            season.to_pickle(pkl_name)
+    seasons = [str(x) for x in range(min_year, max_year + 1)]
+    all_seasons = {season: load_season_cache(season, packed=packed) for season in seasons}
+    missing = [season for season, season_df in all_seasons.items() if season_df is None]
+    instrumentation.count("season_cache.hits", len(seasons) - len(missing))
+    instrumentation.count("season_cache.misses", len(missing))
 
-        all_seasons.append(season)
-    return pd.concat(all_seasons)
+    if missing:
+        if (workers is None) or (workers > 1):
+            # NOTE: stage timings from the worker processes don't make it back here
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+                for season, elapsed in pool.map(_build_season_cache, missing):
+                    print(f"parsed {season} in {elapsed:.1f}s")
+        else:
+            for season in missing:
+                print(f"parsing {season}")
+                season, elapsed = _build_season_cache(season)
+                print(f"parsed {season} in {elapsed:.1f}s")
+
+        for season in missing:
+            all_seasons[season] = load_season_cache(season, packed=packed)
+
+    return pd.concat(all_seasons.values())
 
 def get_all_player_games(min_year=MIN_SEASON, max_year=MAX_SEASON):
     return get_all_seasons(min_year, max_year)
 
-def get_all_player_streaks(all_seasons=None):
+@instrumentation.timed()
+def get_all_player_streaks(all_seasons=None, include_raw_data=False):
     """
     This gets streakiness data for every player over the course of their career.
+
+    careers are rolled up from the makes/misses/runs of each player-game (see
+    streak_converter.combine_summaries), so the shots themselves aren't needed.
+    set include_raw_data to also get each career as one long W/L string (or
+    packed bytes, if all_seasons is packed).
     """
     if all_seasons is None:
         all_seasons = get_all_seasons()
     streak_helper = streaks_base.StreaksBase()
-    stats_df = pd.DataFrame(columns=["player_id", "player_name", "makes", 
-                                "misses", "total_streaks", "raw_data"])
-        
-    for key, results in all_seasons.groupby(["player_id"]):
-        all_shots = "".join(results["raw_data"])
-        streak_data = streak_converter.convert_to_streaks(False, all_shots, False)
-        stats_df.loc[len(stats_df)] = [key[0], results["player_name"].iloc[0], streak_data['makes'],  streak_data['misses'],
-                                    streak_data['total_streaks'], streak_data['raw_data']
-                                    ]
-    stats_df.set_index("player_id")
+
+    # every player's games, in order
+    player_games = all_seasons.reset_index()
+    order_by = [column for column in ["player_id", "season", "game_id"] if column in player_games]
+    player_games = player_games.sort_values(by=order_by, kind="stable")
+
+    careers = streak_converter.combine_summaries(player_games, "player_id", include_raw_data)
+    columns = ["player_id", "player_name", "makes", "misses", "total_streaks"]
+    if include_raw_data:
+        columns.append("raw_packed" if "raw_packed" in careers else "raw_data")
+    stats_df = careers.reset_index()[columns + ["first_made", "last_made"]]
+
     df_with_stats = streak_helper.calc_stats(stats_df)
     return df_with_stats
 
+def iter_season_streaks(min_year=MIN_SEASON, max_year=MAX_SEASON, chunk_size=CHUNK_SIZE,
+                        do_percentile_rank=True, packed=False):
+    """
+    the same player-game rows as get_all_seasons, but a chunk at a time (see
+    iter_shot_chunks), so memory use depends on chunk_size instead of how many
+    seasons there are.
+    """
+    for season, shots in iter_shot_chunks(min_year, max_year, chunk_size):
+        # timed per chunk, since timing the generator itself would only time creating it
+        with instrumentation.stage("season_streaks_chunk", rows=len(shots)):
+            combined_df = summarize_player_games(shots, packed)
+            chunk_streaks = add_streak_stats(combined_df, season, do_percentile_rank)
+        yield chunk_streaks
+
+@instrumentation.timed()
+def get_all_player_streaks_streaming(min_year=MIN_SEASON, max_year=MAX_SEASON, chunk_size=CHUNK_SIZE):
+    """
+    get_all_player_streaks, straight from the shots, a chunk at a time. only
+    one row per player gets carried from chunk to chunk (see
+    streak_converter.combine_summaries), so this doesn't need the whole
+    history in memory. careers don't include raw_data.
+
+    games get joined in chunk order, then by game id within a chunk.
+    """
+    careers = None
+    for season, shots in iter_shot_chunks(min_year, max_year, chunk_size):
+        player_games = summarize_player_games(shots, packed=True).drop(columns="raw_packed")
+        player_games = player_games.reset_index(level="game_id", drop=True)
+        if careers is not None:
+            player_games = pd.concat([careers, player_games])
+        careers = streak_converter.combine_summaries(player_games, "player_id")
+
+    stats_df = careers.reset_index()[["player_id", "player_name", "makes", "misses", "total_streaks",
+                                      "first_made", "last_made"]]
+    return streaks_base.StreaksBase().calc_stats(stats_df)
+
+def get_prior_makes(shots, windows=()):
+    """
+    for shots in chronological order (see fix_index): how many shots the player
+    had already taken in the game, how many of those they made, and a dict of
+    makes in their previous n shots for each n in `windows` (NaN until they've
+    taken n shots in the game).
+
+    everything is done with grouped cumulative sums, so the counts only
+    include shots *before* the current one.
+    """
+    player_game = shots.groupby(["PLAYER_ID", "GAME_ID"], sort=False).ngroup().values
+    made = pd.Series(shots["SHOT_MADE"].values.astype(np.int64))
+    by_game = made.groupby(player_game)
+    prior_shots = by_game.cumcount().values
+    makes_in_game = by_game.cumsum().values - made.values
+
+    # from the makes_in_game count n shots ago (shifted within each game, so it doesn't cross games)
+    makes_so_far = pd.Series(makes_in_game).groupby(player_game)
+    makes_in_window = {window: makes_in_game - makes_so_far.shift(window).values for window in windows}
+    return prior_shots, makes_in_game, makes_in_window
+
 ### FIXME (this and some other functions should probbly go to a new file)
-### there is a performance issue with this function.
-### with the fix to the index (and shot order), it might be a little better.
-def add_sequence_data(base_shots):
+@instrumentation.timed()
+def add_sequence_data(base_shots, windows=(5,)):
     """
-    takes a df with all shots to be analyzed
+    takes a df with all shots to be analyzed (in chronological order, see fix_index)
     adds data about shot sequence and in-game FG% for each player
     for looking at how that correlates with overall shooting performance
+
+    `windows` are the sizes of the "last n shots" FG% columns, eg. windows=(3, 5, 10)
+    adds last_3, last_5 and last_10. those are NaN until the player has taken n shots
+    in the game.
     """
     all_shots = base_shots.copy()
+    prior_shots, makes_in_game, makes_in_window = get_prior_makes(all_shots, windows)
+
+    all_shots['makes_in_game']  = makes_in_game               # avoiding name collision with 'makes' key in career summary
+    all_shots['misses_in_game'] = prior_shots - makes_in_game  # likewise
+    all_shots['shot_seq']       = prior_shots + 1             # sequential (ordinal) shot in game by this player. NOTE: 1 indexed
+    all_shots['shoot_pct']      = np.divide(makes_in_game, prior_shots,  # shooting percentage in game by this player
+                                            out=np.zeros(len(all_shots)), where=prior_shots > 0)
+
+    # shooting percentage over previous n shots by player
+    for window in windows:
+        all_shots[f'last_{window}'] = makes_in_window[window] / window
 
-    all_shots['makes_in_game']  = None  # avoiding name collision with 'makes' key in career summary
-    all_shots['misses_in_game'] = None  # likewise
-    all_shots['shot_seq']       = None  # sequential (ordinal) shot in game by this player
-    all_shots['shoot_pct']      = None  # shooting percentage in game by this player
-    all_shots['last_5']         = None  # shooting percentage over previous 5 shots by player
-
-    # there is almost certainly a better way of doing this with a more
-    # functional programming approach and pandas built-ins (eg the rolling() function)
-    for key, shots in base_shots.groupby(["PLAYER_ID", "GAME_ID"]):
-        make_count = 0
-        miss_count = 0
-        shot_seq = 1        # NOTE: 1 indexed
-        shoot_pct = 0
-        shots_in_game = []
-
-        for key2, shot in shots.iterrows():
-            # the key should be unique and in the right order now.
-
-            condition = key2 ## this should work now
-
-            all_shots.loc[condition, 'makes_in_game'] = make_count
-            all_shots.loc[condition, 'misses_in_game'] = miss_count
-            all_shots.loc[condition, 'shot_seq'] = shot_seq
-            all_shots.loc[condition, 'shoot_pct'] = shoot_pct
-
-            # TODO? replace with rolling(5).sum()?
-            # problem is it needs to be for each game, not across games
-            if len(shots_in_game) > 4:
-                last5_shots = shots_in_game[-5:]
-                all_shots.loc[condition, 'last_5'] = sum(last5_shots) / 5
-
-            if shot.SHOT_MADE:
-                make_count += 1
-                shots_in_game.append(1)
-            else:
-                miss_count += 1
-                shots_in_game.append(0)
-            shoot_pct = make_count / (make_count + miss_count)
-            shot_seq += 1
-    return all_shots
\ No newline at end of file
+    return all_shots
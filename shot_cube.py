@@ -0,0 +1,197 @@
+"""
+Shot counts for every (player, season, makes in the last k shots, zone, made)
+combination, over the whole shot history. Questions like "does this player
+shoot worse after making 4 of their last 5?" are just sums over slices of it,
+instead of another pass over millions of shots with add_sequence_data.
+
+    cube = shot_cube.build()
+    cube.save("shot_cube")
+    ...
+    cube = shot_cube.ShotCube.load("shot_cube")
+    cube.fg_by_streak(players=["Stephen Curry"], by_zone=True)
+
+"makes in the last k" counts the player's previous k shots in the same game,
+like the last_5 column from season_streaks.add_sequence_data (times 5). shots
+that don't have k shots before them in the game are counted separately, and
+left out of the queries unless include_incomplete is set.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import season_streaks
+import instrumentation
+
+WINDOW = 5
+
+ZONES = ["Restricted Area", "In The Paint (Non-RA)", "Mid-Range", "Left Corner 3",
+         "Right Corner 3", "Above the Break 3", "Backcourt"]
+# anything not in ZONES
+OTHER_ZONE = "Other"
+
+CUBE_COLUMNS = ["SEASON_1", "GAME_ID", "PLAYER_ID", "PLAYER_NAME", "SHOT_MADE", "BASIC_ZONE", "SORTABLE_DATE"]
+
+def get_makes_in_window(shots, window=WINDOW):
+    """
+    makes in each shot's previous `window` shots by the same player in the same
+    game, or -1 if there haven't been that many yet. shots need to be in
+    chronological order.
+    """
+    in_window = season_streaks.get_prior_makes(shots, [window])[2][window]
+    return np.where(np.isnan(in_window), -1, in_window).astype(np.int64)
+
+class ShotCube:
+    """
+    counts[player, season, makes in window, zone, made]. the makes-in-window
+    axis goes 0..window, and the last spot is for shots without enough shots
+    before them.
+    """
+    def __init__(self, counts, player_ids, player_names, seasons, zones=ZONES + [OTHER_ZONE], window=WINDOW):
+        self.counts = counts
+        self.player_ids = list(player_ids)
+        self.player_names = list(player_names)
+        self.seasons = [str(season) for season in seasons]
+        self.zones = list(zones)
+        self.window = window
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "counts.npy"), self.counts)
+        labels = {
+            "player_ids": [int(player_id) for player_id in self.player_ids],
+            "player_names": self.player_names,
+            "seasons": self.seasons,
+            "zones": self.zones,
+            "window": self.window,
+        }
+        with open(os.path.join(directory, "labels.json"), "w") as f:
+            json.dump(labels, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, "labels.json")) as f:
+            labels = json.load(f)
+        counts = np.load(os.path.join(directory, "counts.npy"), mmap_mode="r" if mmap else None)
+        return cls(counts, labels["player_ids"], labels["player_names"], labels["seasons"],
+                   labels["zones"], labels["window"])
+
+    def _get_player_indexes(self, players):
+        """
+        players can be ids or names (or a mix).
+        """
+        if players is None:
+            return slice(None)
+        if isinstance(players, (str, int, np.integer)):
+            players = [players]
+        indexes = []
+        for player in players:
+            if isinstance(player, str):
+                matches = [i for i, name in enumerate(self.player_names) if name == player]
+                if not matches:
+                    raise KeyError(player)
+                indexes.extend(matches)
+            else:
+                indexes.append(self.player_ids.index(int(player)))
+        return indexes
+
+    def _get_season_indexes(self, seasons):
+        if seasons is None:
+            return slice(None)
+        if isinstance(seasons, (str, int, np.integer)):
+            seasons = [seasons]
+        return [self.seasons.index(str(season)) for season in seasons]
+
+    def select(self, players=None, seasons=None):
+        """
+        counts for some players and seasons, added up: [makes in window, zone, made].
+        None means all of them.
+        """
+        counts = self.counts[self._get_player_indexes(players)]
+        counts = counts[:, self._get_season_indexes(seasons)]
+        return counts.sum(axis=(0, 1))
+
+    def _get_window_labels(self, include_incomplete):
+        labels = list(range(self.window + 1))
+        if include_incomplete:
+            labels.append("incomplete")
+        return labels
+
+    def fg_by_streak(self, players=None, seasons=None, by_zone=False, include_incomplete=False):
+        """
+        FG% by makes in the last `window` shots (and zone, if by_zone is set).
+        """
+        counts = self.select(players, seasons)
+        if not include_incomplete:
+            counts = counts[:-1]
+        labels = self._get_window_labels(include_incomplete)
+
+        if by_zone:
+            index = pd.MultiIndex.from_product([labels, self.zones],
+                                               names=[f"makes_in_last_{self.window}", "zone"])
+            counts = counts.reshape(-1, 2)
+        else:
+            index = pd.Index(labels, name=f"makes_in_last_{self.window}")
+            counts = counts.sum(axis=1)
+
+        attempts = counts.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fg_pct = counts[:, 1] / attempts
+        return pd.DataFrame({"attempts": attempts, "makes": counts[:, 1], "fg_pct": fg_pct}, index=index)
+
+    def shot_mix(self, players=None, seasons=None, include_incomplete=False):
+        """
+        share of shots from each zone, by makes in the last `window` shots.
+        """
+        counts = self.select(players, seasons).sum(axis=2)
+        if not include_incomplete:
+            counts = counts[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mix = counts / counts.sum(axis=1, keepdims=True)
+        return pd.DataFrame(mix, columns=self.zones,
+                            index=pd.Index(self._get_window_labels(include_incomplete),
+                                           name=f"makes_in_last_{self.window}"))
+
+@instrumentation.timed("build_shot_cube")
+def build(min_year=season_streaks.MIN_SEASON, max_year=season_streaks.MAX_SEASON, window=WINDOW,
+          chunk_size=season_streaks.CHUNK_SIZE):
+    """
+    goes through every shot from min_year to max_year once (a chunk at a time,
+    see season_streaks.iter_shot_chunks) and counts them up.
+    """
+    seasons = [str(season) for season in range(min_year, max_year + 1)]
+    zones = ZONES + [OTHER_ZONE]
+    zone_codes = {zone: code for code, zone in enumerate(ZONES)}
+
+    player_index = {}
+    player_names = []
+    counts = np.zeros((0, len(seasons), window + 2, len(zones), 2), dtype=np.uint32)
+
+    for season, shots in season_streaks.iter_shot_chunks(min_year, max_year, chunk_size, CUBE_COLUMNS):
+        # new players get added on to the end of the player axis
+        chunk_players, first_shots = np.unique(shots["PLAYER_ID"].values, return_index=True)
+        for player_id, first_shot in zip(chunk_players, first_shots):
+            if player_id not in player_index:
+                player_index[player_id] = len(player_index)
+                player_names.append(str(shots["PLAYER_NAME"].values[first_shot]))
+        if len(player_index) > counts.shape[0]:
+            more = np.zeros((len(player_index) - counts.shape[0],) + counts.shape[1:], dtype=counts.dtype)
+            counts = np.concatenate([counts, more])
+
+        players = pd.Series(shots["PLAYER_ID"].values).map(player_index).values
+        in_window = get_makes_in_window(shots, window)
+        in_window[in_window < 0] = window + 1
+        zone = pd.Series(shots["BASIC_ZONE"].astype(str).values).map(zone_codes).fillna(len(ZONES))
+        made = shots["SHOT_MADE"].values.astype(np.int64)
+
+        cell = np.ravel_multi_index((players, np.full(len(shots), seasons.index(season)), in_window,
+                                     zone.values.astype(np.int64), made), counts.shape)
+        # only count over the range of cells this chunk touches, not the whole cube
+        first_cell = cell.min()
+        chunk_counts = np.bincount(cell - first_cell)
+        counts.reshape(-1)[first_cell:first_cell + len(chunk_counts)] += chunk_counts.astype(counts.dtype)
+
+    player_ids = list(player_index)
+    return ShotCube(counts, player_ids, player_names, seasons, zones, window)
@@ -0,0 +1,91 @@
+import os
+
+import pandas as pd
+
+import streak_cache
+
+# Parquet copy of the kaggle shot data (https://www.kaggle.com/datasets/mexwell/nba-shots)
+# one file per season, already in chronological order, so it doesn't need to go
+# through season_streaks.fix_index again.
+KAGGLE_DIR = "kaggle_data"
+STORE_DIR = "shot_store"
+
+# repeated strings are stored as categoricals, which is most of the size of the CSVs.
+CATEGORICAL_COLUMNS = ["SEASON_2", "TEAM_NAME", "PLAYER_NAME", "POSITION_GROUP", "POSITION",
+                       "HOME_TEAM", "AWAY_TEAM", "EVENT_TYPE", "ACTION_TYPE", "SHOT_TYPE",
+                       "BASIC_ZONE", "ZONE_NAME", "ZONE_ABB", "ZONE_RANGE"]
+
+# the columns the streak code actually needs.
+STREAK_COLUMNS = ["SEASON_1", "GAME_ID", "PLAYER_ID", "PLAYER_NAME", "SHOT_MADE"]
+
+# files are written in row groups this big, so they can be read a piece at a
+# time (see iter_season_batches) without loading a whole season.
+ROW_GROUP_SIZE = 100_000
+
+def get_csv_filename(season, csv_dir=KAGGLE_DIR):
+    return os.path.join(csv_dir, f"NBA_{season}_Shots.csv")
+
+def get_store_filename(season, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"season={season}", "shots.parquet")
+
+def has_season(season, store_dir=STORE_DIR):
+    return os.path.exists(get_store_filename(season, store_dir))
+
+def ingest_season(season, csv_dir=KAGGLE_DIR, store_dir=STORE_DIR):
+    """
+    converts one season of kaggle CSV data to a sorted Parquet file.
+    """
+    # imported here, season_streaks imports this module.
+    import season_streaks
+
+    shots = season_streaks.fix_index(pd.read_csv(get_csv_filename(season, csv_dir)))
+    for column in CATEGORICAL_COLUMNS:
+        if column in shots:
+            shots[column] = shots[column].astype("category")
+
+    filename = get_store_filename(season, store_dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    streak_cache.write_atomic(filename, lambda tmp_filename: shots.to_parquet(
+        tmp_filename, index=False, row_group_size=ROW_GROUP_SIZE))
+    return len(shots)
+
+def ingest(seasons=None, csv_dir=KAGGLE_DIR, store_dir=STORE_DIR):
+    """
+    one-time conversion of all the kaggle CSVs to the Parquet store.
+    """
+    import season_streaks
+
+    if seasons is None:
+        seasons = range(season_streaks.MIN_SEASON, season_streaks.MAX_SEASON + 1)
+    for season in seasons:
+        num_shots = ingest_season(season, csv_dir, store_dir)
+        print(f"{season}: {num_shots} shots")
+
+def read_season(season, columns=None, store_dir=STORE_DIR):
+    """
+    one season of shots, in chronological order. `columns` limits which
+    columns get read off disk.
+    """
+    return pd.read_parquet(get_store_filename(season, store_dir), columns=columns)
+
+def iter_season_batches(season, columns=None, batch_size=ROW_GROUP_SIZE, store_dir=STORE_DIR):
+    """
+    one season of shots in chronological order, `batch_size` shots at a time.
+    only about one row group is in memory at once.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(get_store_filename(season, store_dir))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def read_seasons(seasons, columns=None, store_dir=STORE_DIR):
+    """
+    several seasons of shots in chronological order.
+    """
+    all_shots = [read_season(season, columns, store_dir) for season in seasons]
+    # the seasons are each sorted already, so they just need to be stacked up.
+    return pd.concat(all_shots, ignore_index=True)
+
+if __name__ == "__main__":
+    ingest()
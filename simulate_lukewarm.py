@@ -1,6 +1,7 @@
 import collections
-import functools
-import operator
+import concurrent.futures
+import itertools
+import os
 
 import pandas as pd
 import numpy as np
@@ -8,20 +9,34 @@ import numpy as np
 import streaky_players
 import wald_wolfowitz
 import streak_converter
+import instrumentation
+
+# z-scores are binned this finely when summarizing an ensemble of simulated seasons
+Z_BINS = np.linspace(-6, 6, 241)
+ENSEMBLE_QUANTILES = [.025, .05, .25, .5, .75, .95, .975]
+
+def sim_career(sim_player, shots_per_game):
+    """
+    simulates every game of a career (or season), given the number of shots in each game.
+    returns all the makes (1) and misses (0) in order.
+    """
+    makes_misses = []
+    for shot_count in shots_per_game:
+        makes_misses.append(sim_player.take_shots(shot_count))
+        sim_player.end_game()
+    return pd.Series(np.concatenate(makes_misses) if makes_misses else [], dtype=np.int64)
 
 class SimulationBase:
     def handle_season(self, results):
         # returns streakiness stats for a player's season.
-        makes = sum(results > 0)
-        misses = sum(results == 0)
+        streak_data = streak_converter.get_run_stats(results)
+        makes = streak_data['makes']
+        misses = streak_data['misses']
         if (makes + misses) > 3:
-            expected = wald_wolfowitz.get_expected_streaks(makes, misses)
-            streak_data = streak_converter.convert_to_streaks(results)
             total_streaks = streak_data['total_streaks']
-            variance = wald_wolfowitz.get_variance(makes, misses, expected)
-            if variance > 0:
-                z_score = (total_streaks - expected) / np.sqrt(variance)
-                return (total_streaks, expected, variance, z_score)
+            stats = wald_wolfowitz.get_streak_stats([makes], [misses], [total_streaks])
+            if stats['variance'][0] > 0:
+                return (total_streaks, stats['expected_streaks'][0], stats['variance'][0], stats['z_score'][0])
             else:
                 return None
         else:
@@ -32,6 +47,7 @@ class SimulateLukewarm(SimulationBase):
         self.df = df # this is all shots in a season.
         self.player_type = streaky_players.LukewarmPlayer
         self.player_cache = {}
+        self.rng = streaky_players.rng
 
         # calculate fg_percentages.
         makes = self.df.groupby("player_id")["makes"].sum()
@@ -45,15 +61,81 @@ class SimulateLukewarm(SimulationBase):
             return self.player_cache[player_id]
         else:
             player_fg_percentage = self.fg_percentage[player_id]
-            player = self.player_type(shooting_percentage=player_fg_percentage)
+            player = self.player_type(player_fg_percentage)
+            player.rng = self.rng
 
             self.player_cache[player_id] = player
             return player
 
+    @instrumentation.timed("sim_season")
     def sim_season(self):
         """
         simulates entire season (every player, every game) using actual shot counts and fg% by player
         """
+        template_player = self.player_type(.5)
+        if hasattr(template_player, "get_shooting_percentages"):
+            return self.sim_season_vectorized(template_player)
+        return self.sim_season_by_player()
+
+    def sim_season_vectorized(self, template_player):
+        """
+        sim_season, but every player-game in the season is simulated in lockstep:
+        shot #1 for everybody, then shot #2 for everybody who took at least 2 shots,
+        and so on. the player's streaky behavior comes from
+        template_player.get_shooting_percentages(), applied to the running
+        makes/attempts of every player-game at once.
+        """
+        games = self.df.groupby(["player_id", "game_id"])[["makes", "misses"]].sum()
+        player_ids = games.index.get_level_values("player_id").values
+        num_shots = (games.makes + games.misses).values.astype(np.int64)
+        shooting_percentages = self.fg_percentage.reindex(player_ids).values
+
+        # most shots first, so the player-games still shooting are always a prefix.
+        order = np.argsort(-num_shots, kind="stable")
+        sorted_shots = num_shots[order]
+        sorted_percentages = shooting_percentages[order]
+        max_shots = sorted_shots[0] if len(sorted_shots) else 0
+
+        shot_results = np.zeros((len(games), max_shots), dtype=bool)
+        makes = np.zeros(len(games), dtype=np.int64)
+        for shot_num in range(max_shots):
+            num_active = np.searchsorted(-sorted_shots, -shot_num, side="left")
+            shoot_pct = template_player.get_shooting_percentages(
+                sorted_percentages[:num_active], makes[:num_active], shot_num)
+            made = self.rng.random(num_active) < shoot_pct
+            shot_results[:num_active, shot_num] = made
+            makes[:num_active] += made
+
+        # back to (player, game) order, then line up each player's games end to end
+        shot_results[order] = shot_results.copy()
+        in_game = np.arange(max_shots) < num_shots[:, None]
+        all_shots = shot_results[in_game]
+
+        new_player = np.ones(len(games), dtype=bool)
+        new_player[1:] = player_ids[1:] != player_ids[:-1]
+        player_starts = np.concatenate([[0], np.cumsum(num_shots)[:-1]])[new_player]
+
+        summary = streak_converter.summarize_groups(all_shots, player_starts)
+        stats = wald_wolfowitz.get_streak_stats(summary['makes'], summary['misses'], summary['total_streaks'])
+
+        # same rules as handle_season: enough shots, and some variance
+        usable = ((summary['makes'] + summary['misses']) > 3) & (stats['variance'] > 0)
+        sim_summary = pd.DataFrame({
+            "actual": summary['total_streaks'][usable],
+            "expected": stats['expected_streaks'][usable],
+            "variance": stats['variance'][usable],
+            "z_score": stats['z_score'][usable],
+        })
+
+        self.shot_results = shot_results # for debug
+        self.num_shots = num_shots
+        return sim_summary
+
+    def sim_season_by_player(self):
+        """
+        simulates the season one shot at a time, through each player's take_shot().
+        this works for any player type, but is much slower than sim_season_vectorized.
+        """
         game_results = collections.defaultdict(list)
         player_games = []
         
@@ -75,7 +157,7 @@ class SimulateLukewarm(SimulationBase):
         season_results = []
         for player_id in game_results.keys():
             # each game results is an array, this combines them into one big array.
-            makes_misses = functools.reduce(operator.add, game_results[player_id])
+            makes_misses = list(itertools.chain.from_iterable(game_results[player_id]))
             
             player_stats = self.handle_season(pd.Series(makes_misses))
 
@@ -86,4 +168,86 @@ class SimulateLukewarm(SimulationBase):
 
         self.game_results = game_results # for debug
         self.player_games = player_games
-        return sim_summary
\ No newline at end of file
+        return sim_summary
+
+
+def _summarize_z_scores(z_scores, bins=Z_BINS):
+    z_scores = np.asarray(z_scores)
+    # anything off the ends goes in the end bins
+    clipped = np.clip(z_scores, bins[0], bins[-1])
+    return {
+        "count": len(z_scores),
+        "sum": z_scores.sum(),
+        "sum_squares": (z_scores ** 2).sum(),
+        "histogram": np.histogram(clipped, bins=bins)[0],
+    }
+
+def _sim_ensemble_chunk(df, player_type, seeds, bins=Z_BINS):
+    """
+    simulates one season per seed, and returns a summary of each season's z-scores.
+    """
+    sim = SimulateLukewarm(df)
+    sim.player_type = player_type
+    season_summaries = []
+    for seed in seeds:
+        sim.rng = np.random.default_rng(seed)
+        sim.player_cache = {}
+        season_summaries.append(_summarize_z_scores(sim.sim_season().z_score, bins))
+    return season_summaries
+
+def _histogram_quantiles(histogram, bins, quantiles):
+    cumulative = np.concatenate([[0], np.cumsum(histogram)]) / histogram.sum()
+    return np.interp(quantiles, cumulative, bins)
+
+@instrumentation.timed()
+def run_ensemble(df, player_type=streaky_players.LukewarmPlayer, num_seasons=1000,
+                 seed=2718, workers=None, bins=Z_BINS, quantiles=ENSEMBLE_QUANTILES):
+    """
+    simulates `num_seasons` seasons (see SimulateLukewarm) across a pool of `workers`
+    processes, and returns a summary of the z-score distribution instead of every season.
+
+    `player_type` gets called with each player's FG%. it has to be picklable to
+    go to the workers, so use functools.partial rather than a lambda for players
+    that need more arguments, eg. partial(LastFivePlayer, last5).
+
+    every season gets its own random stream, spawned from `seed`, so results are
+    reproducible no matter how many workers there are.
+
+    returns a dict with:
+        mean, std: of all the simulated z-scores
+        quantiles: of all the simulated z-scores (interpolated from the histogram)
+        season_mean_quantiles: quantiles of the average z-score of each season,
+            for confidence bands around a real season's average
+        histogram: density of all the simulated z-scores, by bin center
+    """
+    # the workers only need makes/misses for every player-game
+    df = df[["makes", "misses"]]
+    seeds = np.random.SeedSequence(seed).spawn(num_seasons)
+
+    if workers == 1:
+        season_summaries = _sim_ensemble_chunk(df, player_type, seeds, bins)
+    else:
+        num_chunks = (workers or os.cpu_count() or 1) * 4
+        chunks = [seeds[i::num_chunks] for i in range(num_chunks) if seeds[i::num_chunks]]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            chunk_results = pool.map(_sim_ensemble_chunk, itertools.repeat(df), itertools.repeat(player_type),
+                                     chunks, itertools.repeat(bins))
+            season_summaries = list(itertools.chain.from_iterable(chunk_results))
+
+    count = sum(x["count"] for x in season_summaries)
+    total = sum(x["sum"] for x in season_summaries)
+    total_squares = sum(x["sum_squares"] for x in season_summaries)
+    histogram = np.sum([x["histogram"] for x in season_summaries], axis=0)
+    season_means = np.array([x["sum"] / x["count"] for x in season_summaries if x["count"]])
+
+    mean = total / count
+    bin_centers = (bins[1:] + bins[:-1]) / 2
+    return {
+        "num_seasons": num_seasons,
+        "count": count,
+        "mean": mean,
+        "std": np.sqrt((total_squares / count) - (mean ** 2)),
+        "quantiles": pd.Series(_histogram_quantiles(histogram, bins, quantiles), index=quantiles),
+        "season_mean_quantiles": pd.Series(np.quantile(season_means, quantiles), index=quantiles),
+        "histogram": pd.Series(histogram / (count * np.diff(bins)), index=bin_centers),
+    }
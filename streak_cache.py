@@ -0,0 +1,189 @@
+"""
+Cache for expensive results (season streak tables, etc). Every entry is keyed
+by a hash of its input files, its parameters and the code version, so a changed
+CSV or a code change means a rebuild of just the entries it affects, instead of
+deleting pickles by hand.
+
+Each entry is a Parquet file plus a small JSON manifest next to it, recording
+what went into it, both named by the key. Entries with different parameters
+live side by side, and saving one only replaces entries with the same name and
+parameters (ie. built from older inputs or code). Entries are written by
+whichever process builds them, so there's no shared file to fight over.
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+CACHE_DIR = "streak_cache"
+
+# bump this when a change to the code changes what ends up in the cache, so
+# everything gets rebuilt. individual modules can also pass their own `version`.
+CODE_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def get_manifest_filename(name, key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{name}-{key}.json")
+
+def get_data_filename(name, key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{name}-{key}.parquet")
+
+def get_hash_filename(filename, cache_dir=CACHE_DIR):
+    # one file per input, so processes hashing different files don't overwrite each other
+    path_hash = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "file_hashes", f"{os.path.basename(filename)}-{path_hash}.json")
+
+def write_atomic(filename, write):
+    """
+    calls write() with a temp filename, then renames it to `filename`, so a crash
+    never leaves half a file behind. safe to call from several processes or
+    threads at once.
+    """
+    tmp_filename = f"{filename}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        write(tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def write_json_atomic(filename, data, **kwargs):
+    def write(tmp_filename):
+        with open(tmp_filename, "w") as f:
+            json.dump(data, f, **kwargs)
+    write_atomic(filename, write)
+
+def _read_json(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _same_params(a, b):
+    return json.dumps(a, sort_keys=True, default=str) == json.dumps(b, sort_keys=True, default=str)
+
+def hash_file(filename, cache_dir=CACHE_DIR):
+    """
+    sha256 of a file. hashing all the kaggle CSVs takes a while, so the hash is
+    remembered for as long as the file's size and modification time don't change.
+    """
+    stat = os.stat(filename)
+    signature = [stat.st_size, stat.st_mtime_ns]
+
+    hash_filename = get_hash_filename(filename, cache_dir)
+    known = _read_json(hash_filename)
+    if known and known["signature"] == signature:
+        return known["sha256"]
+
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    os.makedirs(os.path.dirname(hash_filename), exist_ok=True)
+    write_json_atomic(hash_filename, {"filename": os.path.abspath(filename), "signature": signature,
+                                      "sha256": digest})
+    return digest
+
+def get_key(params, input_files=(), version=None, cache_dir=CACHE_DIR):
+    """
+    hash of everything that goes into a cache entry.
+    """
+    description = {
+        "params": params,
+        "code_version": CODE_VERSION,
+        "version": version,
+        "inputs": {os.path.basename(f): hash_file(f, cache_dir) for f in input_files},
+    }
+    as_json = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha256(as_json.encode()).hexdigest()[:16]
+
+def load(name, params, input_files=(), version=None, columns=None, cache_dir=CACHE_DIR):
+    """
+    returns the cached dataframe, or None if it's missing or out of date.
+    """
+    key = get_key(params, input_files, version, cache_dir)
+    if _read_json(get_manifest_filename(name, key, cache_dir)) is None:
+        return None
+    try:
+        return pd.read_parquet(get_data_filename(name, key, cache_dir), columns=columns)
+    except FileNotFoundError:
+        return None
+
+def save(name, df, params, input_files=(), version=None, cache_dir=CACHE_DIR):
+    """
+    saves a dataframe to the cache, replacing any older version of it (same
+    name and params, but different inputs or code version).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = get_key(params, input_files, version, cache_dir)
+
+    data_filename = get_data_filename(name, key, cache_dir)
+    write_atomic(data_filename, lambda tmp_filename: df.to_parquet(tmp_filename))
+
+    manifest = {
+        "name": name,
+        "key": key,
+        "params": params,
+        "code_version": CODE_VERSION,
+        "version": version,
+        "inputs": [os.path.abspath(f) for f in input_files],
+        "rows": len(df),
+        "created": datetime.datetime.now().isoformat(),
+    }
+
+    manifest_filename = get_manifest_filename(name, key, cache_dir)
+    write_json_atomic(manifest_filename, manifest, indent=2, default=str)
+
+    # {name}.json is where the manifest went before entries were named by key. nothing
+    # reads it anymore, so it always goes (but not the data, if it's this entry's).
+    legacy_filename = os.path.join(cache_dir, f"{name}.json")
+    for old_filename in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}-*.json")) + \
+                        [legacy_filename]:
+        if old_filename == manifest_filename:
+            continue
+        old_manifest = _read_json(old_filename)
+        if (not old_manifest) or (old_manifest.get("name") != name):
+            continue
+        if old_filename != legacy_filename and not _same_params(old_manifest.get("params"), manifest["params"]):
+            continue
+        old_files = [old_filename]
+        if old_manifest.get("key") != key:
+            old_files.append(get_data_filename(name, old_manifest["key"], cache_dir))
+        for filename in old_files:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+def cached(name, build, params, input_files=(), version=None, cache_dir=CACHE_DIR):
+    """
+    load `name` from the cache, or call build() and cache what it returns.
+    """
+    df = load(name, params, input_files, version, cache_dir=cache_dir)
+    if df is None:
+        df = build()
+        save(name, df, params, input_files, version, cache_dir)
+    return df
+
+def get_manifest(cache_dir=CACHE_DIR):
+    """
+    everything that's in the cache, one row per entry.
+    """
+    manifests = []
+    for filename in sorted(glob.glob(os.path.join(glob.escape(cache_dir), "*.json"))):
+        manifest = _read_json(filename)
+        # only {name}-{key}.json manifests. leftover old-layout {name}.json ones
+        # (and anything else) don't point at a live entry.
+        if isinstance(manifest, dict) and \
+                os.path.basename(filename) == f"{manifest.get('name')}-{manifest.get('key')}.json":
+            manifests.append(manifest)
+    return pd.DataFrame(manifests)
@@ -1,33 +1,417 @@
-import re
+import collections
+
+import numpy as np
 import pandas as pd
-import functools
 
-w_pattern = re.compile(r"(W{1,}+)")
-l_pattern = re.compile(r"(L{1,}+)")
+MAKE = ord("W")
+MISS = ord("L")
+
+def to_made_array(shots, length=None):
+    """
+    converts shot results to a boolean numpy array (True is a make).
+    takes a "W"/"L" string, a Series/array of 0/1, True/False or "W"/"L",
+    or packed bytes (see pack) along with the number of shots.
+
+    >>> to_made_array("WWLW")
+    array([ True,  True, False,  True])
+    >>> to_made_array(pd.Series([0, 1, 1]))
+    array([False,  True,  True])
+    >>> to_made_array(pack("WWLW"), 4)
+    array([ True,  True, False,  True])
+    """
+    if isinstance(shots, (bytes, bytearray)):
+        return unpack(shots, length)
+    if isinstance(shots, str):
+        return np.frombuffer(shots.encode("ascii"), dtype=np.uint8) == MAKE
+
+    values = np.asarray(shots)
+    if values.dtype.kind in "US" or (values.dtype.kind == "O" and len(values) and isinstance(values[0], str)):
+        return values == "W"
+    return values.astype(bool)
+
+def to_str(made):
+    """
+    converts a boolean array of makes back to the "W"/"L" string used in raw_data.
+
+    >>> to_str(np.array([True, False, False]))
+    'WLL'
+    """
+    return np.where(made, MAKE, MISS).astype(np.uint8).tobytes().decode("ascii")
+
+def pack(shots):
+    """
+    packs shot results 8 to a byte, for storing instead of a "W"/"L" string.
+    the number of shots (makes + misses) is needed to unpack them again.
+
+    >>> pack("WWLWL")
+    b'\\xd0'
+    """
+    return np.packbits(to_made_array(shots)).tobytes()
+
+def unpack(packed, length):
+    """
+    >>> to_str(unpack(pack("WWLWL"), 5))
+    'WWLWL'
+    """
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=length)
+    return bits.astype(bool)
+
+def _get_byte_offsets(lengths):
+    num_bytes = (np.asarray(lengths, dtype=np.int64) + 7) // 8
+    return np.concatenate([[0], np.cumsum(num_bytes)])
+
+def pack_groups(made, group_starts):
+    """
+    packs each group of shots in `made` separately (see summarize_groups), in
+    one go rather than one group at a time. returns a list of bytes.
+
+    >>> pack_groups(to_made_array("WWLWLLW"), [0, 3, 5])
+    [b'\\xc0', b'\\x80', b'@']
+    """
+    made = np.asarray(made, dtype=bool)
+    group_starts = np.asarray(group_starts, dtype=np.int64)
+    lengths = np.diff(np.append(group_starts, len(made)))
+    byte_offsets = _get_byte_offsets(lengths)
+
+    # pad each group out to a whole number of bytes, then pack everything at once
+    group_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(made)) - group_starts[group_ids]
+    padded = np.zeros(byte_offsets[-1] * 8, dtype=bool)
+    padded[(byte_offsets[group_ids] * 8) + positions] = made
+
+    buffer = np.packbits(padded).tobytes()
+    return [buffer[start:end] for start, end in zip(byte_offsets[:-1], byte_offsets[1:])]
+
+def unpack_groups(packed, lengths):
+    """
+    unpacks a sequence of packed bytes into one long boolean array, the
+    opposite of pack_groups.
+
+    >>> to_str(unpack_groups([pack("WWL"), pack("WL"), pack("LW")], [3, 2, 2]))
+    'WWLWLLW'
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    byte_offsets = _get_byte_offsets(lengths)
+    padded = np.unpackbits(np.frombuffer(b"".join(packed), dtype=np.uint8)).astype(bool)
+
+    group_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    group_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(lengths.sum()) - group_starts[group_ids]
+    return padded[(byte_offsets[group_ids] * 8) + positions]
+
+def join_packed(first, first_lengths, second, second_lengths):
+    """
+    packed version of adding up two columns of "W"/"L" strings row by row.
+    """
+    num_rows = len(first)
+    packed = np.empty(num_rows * 2, dtype=object)
+    packed[0::2] = list(first)
+    packed[1::2] = list(second)
+    lengths = np.empty(num_rows * 2, dtype=np.int64)
+    lengths[0::2] = first_lengths
+    lengths[1::2] = second_lengths
+
+    made = unpack_groups(packed, lengths)
+    joined_lengths = lengths[0::2] + lengths[1::2]
+    return pack_groups(made, np.cumsum(joined_lengths) - joined_lengths)
+
+def get_lengths(df):
+    return (df["makes"].values + df["misses"].values).astype(np.int64)
+
+def pack_raw_data(df):
+    """
+    swaps a frame's raw_data column ("W"/"L" strings) for raw_packed (bytes),
+    which is around 8x smaller. the number of shots is makes + misses.
+    """
+    as_str = "".join(df["raw_data"])
+    lengths = get_lengths(df)
+    packed = pack_groups(to_made_array(as_str), np.cumsum(lengths) - lengths)
+
+    position = df.columns.get_loc("raw_data")
+    df = df.drop(columns="raw_data")
+    df.insert(position, "raw_packed", packed)
+    return df
+
+def unpack_raw_data(df):
+    """
+    the opposite of pack_raw_data, for anything that wants the strings.
+    """
+    lengths = get_lengths(df)
+    as_str = to_str(unpack_groups(df["raw_packed"].values, lengths))
+    ends = np.cumsum(lengths)
+    raw_data = [as_str[end - length:end] for end, length in zip(ends, lengths)]
+
+    position = df.columns.get_loc("raw_packed")
+    df = df.drop(columns="raw_packed")
+    df.insert(position, "raw_data", raw_data)
+    return df
+
+def encode_runs(made):
+    """
+    run-length encodes a boolean array of makes/misses. returns the result of
+    each run and the length of each run.
+
+    >>> encode_runs(to_made_array("WWLWWWL"))
+    (array([ True, False,  True, False]), array([2, 1, 3, 1]))
+    """
+    made = np.asarray(made, dtype=bool)
+    if len(made) == 0:
+        return np.array([], dtype=bool), np.array([], dtype=np.int64)
+
+    run_starts = np.concatenate([[0], np.flatnonzero(made[1:] != made[:-1]) + 1])
+    run_lengths = np.diff(np.append(run_starts, len(made)))
+    return made[run_starts], run_lengths
+
+def get_run_stats(shots, length=None):
+    """
+    makes, misses and number of runs, plus histograms of run lengths
+    (indexed by length), without building any strings. `length` is only
+    needed for packed shots.
+
+    >>> stats = get_run_stats("WWLWWWL")
+    >>> stats['makes'], stats['misses'], stats['total_streaks']
+    (5, 2, 4)
+    >>> stats['make_histogram']
+    array([0, 0, 1, 1])
+    """
+    made = to_made_array(shots, length)
+    run_values, run_lengths = encode_runs(made)
+    makes = int(made.sum())
+
+    return {
+        'makes': makes,
+        'misses': len(made) - makes,
+        'total_streaks': len(run_lengths),
+        'make_histogram': np.bincount(run_lengths[run_values]),
+        'miss_histogram': np.bincount(run_lengths[~run_values]),
+        }
 
 def convert_to_streaks(bools, as_str=None, need_lengths=True):
     if not as_str:
-        as_make_miss = bools.replace(0, "L") \
-                            .replace(1, "W")
-        as_str = "".join(as_make_miss)
+        made = to_made_array(bools)
+        as_str = to_str(made)
+    else:
+        made = to_made_array(as_str)
 
-    # yeah, this is pretty inefficient.
-    make_streaks  = w_pattern.findall(as_str)
-    miss_streaks =  l_pattern.findall(as_str)
-    total_streaks = len(make_streaks) + len(miss_streaks)
+    run_values, run_lengths = encode_runs(made)
+    make_run_lengths = run_lengths[run_values]
+    miss_run_lengths = run_lengths[~run_values]
+    makes = int(made.sum())
 
     ret = {
         'raw_data': as_str,
-        #'make_lengths': make_lengths.value_counts(),
-        #'miss_lengths': miss_lengths.value_counts(),
-        'make_streaks': make_streaks,
-        'miss_streaks': miss_streaks,
-        'total_streaks': total_streaks,
-        'makes': as_str.count("W"),
-        'misses': as_str.count("L")
+        'make_streaks': ["W" * n for n in make_run_lengths],
+        'miss_streaks': ["L" * n for n in miss_run_lengths],
+        'total_streaks': len(run_lengths),
+        'makes': makes,
+        'misses': len(made) - makes
         }
-    
+
     if need_lengths:
-        ret['make_lengths'] = pd.Series(map(len, make_streaks)).value_counts()
-        ret['miss_lengths'] = pd.Series(map(len, miss_streaks)).value_counts()
-    return ret
\ No newline at end of file
+        ret['make_lengths'] = pd.Series(make_run_lengths).value_counts()
+        ret['miss_lengths'] = pd.Series(miss_run_lengths).value_counts()
+    return ret
+
+def summarize_groups(made, group_starts):
+    """
+    makes, misses and number of runs for every group of shots in one pass.
+    the shots for each group have to be contiguous (and in order) in `made`, and
+    `group_starts` is the index where each group begins.
+
+    also returns the first and last result of each group, which is what's needed
+    to count runs when groups get joined together.
+
+    >>> summary = summarize_groups(to_made_array("WWLWLLW"), [0, 3, 5])
+    >>> summary['makes'], summary['misses'], summary['total_streaks']
+    (array([2, 1, 1]), array([1, 1, 1]), array([2, 2, 2]))
+    >>> summarize_groups([], [])['makes']
+    array([], dtype=int64)
+    """
+    made = np.asarray(made, dtype=bool)
+    group_starts = np.asarray(group_starts, dtype=np.int64)
+    if len(group_starts) == 0:
+        # no shots (eg. a nightly update on a day with no games)
+        no_groups = np.zeros(0, dtype=np.int64)
+        return {'makes': no_groups, 'misses': no_groups, 'total_streaks': no_groups,
+                'first': np.zeros(0, dtype=bool), 'last': np.zeros(0, dtype=bool)}
+    group_ends = np.append(group_starts[1:], len(made))
+
+    # a run starts wherever the result changes, and at the start of every group.
+    run_starts = np.ones(len(made), dtype=np.int64)
+    run_starts[1:] = made[1:] != made[:-1]
+    run_starts[group_starts] = 1
+
+    makes = np.add.reduceat(made.astype(np.int64), group_starts)
+    return {
+        'makes': makes,
+        'misses': (group_ends - group_starts) - makes,
+        'total_streaks': np.add.reduceat(run_starts, group_starts),
+        'first': made[group_starts],
+        'last': made[group_ends - 1],
+        }
+
+class StreakSummary:
+    """
+    everything needed to count runs for a stretch of shots, without keeping the
+    shots themselves: makes, misses, runs, the first and last result, and the
+    lengths of the first and last runs. optionally keeps run-length histograms too.
+
+    summaries of back-to-back stretches of shots merge with +, and it doesn't
+    matter how they're grouped, so careers (or seasons, or home games...) can be
+    built up out of games in any order of merging, as long as the games stay in order.
+
+    >>> a = StreakSummary.from_shots("WWL", need_lengths=True)
+    >>> b = StreakSummary.from_shots("LLWW", need_lengths=True)
+    >>> merged = a + b
+    >>> merged.runs == StreakSummary.from_shots("WWLLLWW").runs
+    True
+    >>> merged.makes, merged.misses, merged.runs, dict(merged.miss_lengths)
+    (4, 3, 3, {3: 1})
+    """
+    __slots__ = ["makes", "misses", "runs", "first", "last", "first_run", "last_run",
+                 "make_lengths", "miss_lengths"]
+
+    def __init__(self, makes=0, misses=0, runs=0, first=None, last=None, first_run=0, last_run=0,
+                 make_lengths=None, miss_lengths=None):
+        self.makes = makes
+        self.misses = misses
+        self.runs = runs
+        self.first = first          # True/False for make/miss, None if there are no shots
+        self.last = last
+        self.first_run = first_run  # length of the first run
+        self.last_run = last_run    # length of the last run
+        self.make_lengths = make_lengths  # collections.Counter of run length -> count
+        self.miss_lengths = miss_lengths
+
+    @classmethod
+    def from_shots(cls, shots, need_lengths=False, length=None):
+        run_values, run_lengths = encode_runs(to_made_array(shots, length))
+        if len(run_lengths) == 0:
+            return cls(make_lengths=collections.Counter() if need_lengths else None,
+                       miss_lengths=collections.Counter() if need_lengths else None)
+
+        makes = int(run_lengths[run_values].sum())
+        summary = cls(makes=makes, misses=int(run_lengths.sum()) - makes, runs=len(run_lengths),
+                      first=bool(run_values[0]), last=bool(run_values[-1]),
+                      first_run=int(run_lengths[0]), last_run=int(run_lengths[-1]))
+        if need_lengths:
+            summary.make_lengths = collections.Counter(run_lengths[run_values].tolist())
+            summary.miss_lengths = collections.Counter(run_lengths[~run_values].tolist())
+        return summary
+
+    @property
+    def shots(self):
+        return self.makes + self.misses
+
+    def __add__(self, other):
+        if other.shots == 0:
+            return self
+        if self.shots == 0:
+            return other
+
+        joined = self.last == other.first
+        merged = StreakSummary(
+            makes=self.makes + other.makes,
+            misses=self.misses + other.misses,
+            runs=self.runs + other.runs - joined,
+            first=self.first,
+            last=other.last,
+            first_run=self.first_run,
+            last_run=other.last_run)
+
+        if joined:
+            joined_run = self.last_run + other.first_run
+            # if either side was one long run, the joined run is at the end of the merged one too
+            if self.runs == 1:
+                merged.first_run = joined_run
+            if other.runs == 1:
+                merged.last_run = joined_run
+
+        if (self.make_lengths is not None) and (other.make_lengths is not None):
+            merged.make_lengths = self.make_lengths + other.make_lengths
+            merged.miss_lengths = self.miss_lengths + other.miss_lengths
+            if joined:
+                lengths = merged.make_lengths if self.last else merged.miss_lengths
+                lengths.subtract([self.last_run, other.first_run])
+                lengths[self.last_run + other.first_run] += 1
+                for length in [self.last_run, other.first_run]:
+                    if lengths[length] == 0:
+                        del lengths[length]
+        return merged
+
+    def __repr__(self):
+        return (f"StreakSummary(makes={self.makes}, misses={self.misses}, runs={self.runs}, "
+                f"first={self.first}, last={self.last})")
+
+def add_boundaries(df):
+    """
+    makes sure `df` has first_made/last_made columns (the first/last shot of each row).
+    frames built before those columns existed get them from raw_data.
+    """
+    if ("first_made" not in df) or ("last_made" not in df):
+        df = df.copy()
+        df["first_made"] = (df["raw_data"].str[0] == "W").values
+        df["last_made"] = (df["raw_data"].str[-1] == "W").values
+    return df
+
+def combine_summaries(df, by, need_raw_data=False):
+    """
+    vectorized StreakSummary merging for a whole frame: rolls up rows of makes,
+    misses, total_streaks, first_made and last_made (eg. player-games) into one
+    row per `by` group (eg. player). each group's rows are merged in the order
+    they're in, so they need to be in order. `by` can be columns or index levels.
+
+    raw_data (or raw_packed) only gets joined up if need_raw_data is set.
+    """
+    df = add_boundaries(df)
+    keys = df.reset_index()[by]
+    # bring each group's rows together, keeping them in the same order
+    if isinstance(keys, pd.DataFrame):
+        order = np.lexsort([keys[column].values for column in reversed(keys.columns)])
+    else:
+        order = np.argsort(keys.values, kind="stable")
+    df = df.iloc[order]
+    keys = keys.iloc[order]
+
+    if isinstance(keys, pd.DataFrame):
+        same_group = (keys.iloc[1:].values == keys.iloc[:-1].values).all(axis=1)
+    else:
+        same_group = keys.values[1:] == keys.values[:-1]
+
+    first_made = df["first_made"].values.astype(bool)
+    last_made = df["last_made"].values.astype(bool)
+    # a row whose first shot continues the run at the end of the row before
+    joined = np.zeros(len(df), dtype=np.int64)
+    joined[1:] = same_group & (last_made[:-1] == first_made[1:])
+
+    rows = pd.DataFrame({
+        "makes": df["makes"].values.astype(np.int64),
+        "misses": df["misses"].values.astype(np.int64),
+        "total_streaks": df["total_streaks"].values.astype(np.int64) - joined,
+        "first_made": first_made,
+        "last_made": last_made,
+    })
+    aggregations = {"makes": "sum", "misses": "sum", "total_streaks": "sum",
+                    "first_made": "first", "last_made": "last"}
+    if "player_name" in df:
+        rows["player_name"] = df["player_name"].values
+        aggregations = {"player_name": "first", **aggregations}
+    if need_raw_data and ("raw_data" in df):
+        rows["raw_data"] = df["raw_data"].values
+        aggregations["raw_data"] = "".join
+
+    if isinstance(keys, pd.DataFrame):
+        group_keys = [keys[column].values for column in keys.columns]
+    else:
+        group_keys = keys.values
+    combined = rows.groupby(group_keys, sort=False).agg(aggregations)
+    combined.index.names = [by] if isinstance(by, str) else by
+
+    if need_raw_data and ("raw_packed" in df) and ("raw_data" not in df):
+        # the rows are grouped together already, so each group's shots are contiguous
+        lengths = get_lengths(df)
+        row_starts = np.cumsum(lengths) - lengths
+        group_starts = row_starts[np.concatenate([[True], ~same_group])] if len(df) else row_starts
+        made = unpack_groups(df["raw_packed"].values, lengths)
+        combined["raw_packed"] = pack_groups(made, group_starts)
+    return combined
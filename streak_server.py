@@ -0,0 +1,205 @@
+"""
+Small local server that keeps the season and career streak tables in memory,
+so every notebook on the box doesn't have to load (and hold) its own copy.
+
+    python -m hot_hand serve              # or streak_server.serve()
+
+then, from a notebook:
+
+    import streak_server
+    curry = streak_server.query("seasons", player="Stephen Curry", min_season=2015)
+    streaky = streak_server.query("careers", min_attempts=5000, max_z=-2)
+
+Queries are plain HTTP GETs, and results come back as Parquet (or Arrow IPC
+with format=arrow), so anything that reads those can use it. Only standard
+library + pandas/pyarrow, no external services.
+"""
+
+import io
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import season_streaks
+import streak_converter
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+CONTENT_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+class StreakTables:
+    """
+    the season (player-game) and career tables, loaded once. shots stay packed
+    (see streak_converter.pack) to keep memory down.
+    """
+    def __init__(self, min_year=season_streaks.MIN_SEASON, max_year=season_streaks.MAX_SEASON, workers=1):
+        start_time = time.perf_counter()
+        seasons = season_streaks.get_all_seasons(min_year, max_year, workers=workers, packed=True)
+        careers = season_streaks.get_all_player_streaks(seasons)
+        self.tables = {
+            "seasons": seasons.reset_index(),
+            "careers": careers,
+        }
+        self.load_time = time.perf_counter() - start_time
+
+    def get_status(self):
+        return {
+            "load_time": self.load_time,
+            "tables": {name: {"rows": len(df), "mb": df.memory_usage(deep=True).sum() / 2**20}
+                       for name, df in self.tables.items()},
+        }
+
+    def query(self, table, player=None, min_season=None, max_season=None, min_attempts=None,
+              min_z=None, max_z=None, columns=None):
+        """
+        rows of `table` ("seasons" or "careers") that match every filter given.
+        `player` is a list of ids and/or names. attempts are makes + misses.
+        """
+        df = self.tables[table]
+        mask = np.ones(len(df), dtype=bool)
+
+        if player:
+            ids = [int(p) for p in player if str(p).isdigit()]
+            names = [p for p in player if not str(p).isdigit()]
+            mask &= df["player_id"].isin(ids).values | df["player_name"].isin(names).values
+        if (min_season is not None) and ("season" in df):
+            mask &= df["season"].astype(int).values >= int(min_season)
+        if (max_season is not None) and ("season" in df):
+            mask &= df["season"].astype(int).values <= int(max_season)
+        if min_attempts is not None:
+            mask &= (df["makes"].values + df["misses"].values) >= int(min_attempts)
+        if min_z is not None:
+            mask &= df["z_score"].values >= float(min_z)
+        if max_z is not None:
+            mask &= df["z_score"].values <= float(max_z)
+
+        result = df[mask]
+        if columns:
+            result = result[[column for column in columns if column in result]]
+        return result
+
+def to_bytes(df, output_format="parquet"):
+    if output_format == "arrow":
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+    return df.to_parquet(index=False)
+
+class StreakRequestHandler(BaseHTTPRequestHandler):
+    # set by make_server
+    tables = None
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, "application/json", json.dumps(data).encode())
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        table = url.path.strip("/")
+        params = urllib.parse.parse_qs(url.query)
+
+        if table == "status":
+            return self.send_json(200, self.tables.get_status())
+        if table not in self.tables.tables:
+            return self.send_json(404, {"error": f"no table {table}, try /seasons, /careers or /status"})
+
+        def get_one(name):
+            return params[name][0] if name in params else None
+
+        def get_list(name):
+            # ?player=1&player=2 and ?player=1,2 both work
+            return [value for values in params.get(name, []) for value in values.split(",") if value]
+
+        output_format = get_one("format") or "parquet"
+        if output_format not in CONTENT_TYPES:
+            return self.send_json(400, {"error": f"unknown format {output_format}"})
+        try:
+            result = self.tables.query(table, get_list("player"), get_one("min_season"), get_one("max_season"),
+                                       get_one("min_attempts"), get_one("min_z"), get_one("max_z"),
+                                       get_list("columns"))
+        except ValueError as e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_body(200, CONTENT_TYPES[output_format], to_bytes(result, output_format))
+
+    def log_message(self, format, *args):
+        # one line per query is plenty
+        print(f"{self.address_string()} {format % args}")
+
+def make_server(tables, host=HOST, port=PORT):
+    handler = type("Handler", (StreakRequestHandler,), {"tables": tables})
+    return ThreadingHTTPServer((host, port), handler)
+
+def serve(host=HOST, port=PORT, min_year=season_streaks.MIN_SEASON, max_year=season_streaks.MAX_SEASON,
+          workers=1):
+    """
+    loads the tables and answers queries until it's stopped.
+    only listens on localhost by default.
+    """
+    tables = StreakTables(min_year, max_year, workers)
+    server = make_server(tables, host, port)
+    print(f"loaded in {tables.load_time:.1f}s, serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def start_in_background(tables, host=HOST, port=PORT):
+    """
+    runs a server in a thread of this process (handy for tests and notebooks).
+    returns the server, call .shutdown() to stop it.
+    """
+    server = make_server(tables, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def from_bytes(body, output_format="parquet"):
+    if output_format == "arrow":
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(body).read_pandas()
+    return pd.read_parquet(io.BytesIO(body))
+
+def query(table, host=HOST, port=PORT, unpack=True, output_format="parquet", timeout=60, **filters):
+    """
+    gets rows from a running server as a dataframe. filters are the same as
+    StreakTables.query (player can be one id/name or a list). output_format
+    ("parquet" or "arrow") is what gets sent over the wire. packed shots get
+    turned back into raw_data strings unless unpack=False (or the makes and
+    misses columns needed to unpack them weren't asked for).
+    """
+    params = [("format", output_format)]
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        params.append((name, str(value)))
+    url = f"http://{host}:{port}/{table}?{urllib.parse.urlencode(params)}"
+
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        df = from_bytes(response.read(), output_format)
+    if unpack and ("raw_packed" in df) and ("makes" in df) and ("misses" in df):
+        df = streak_converter.unpack_raw_data(df)
+    return df
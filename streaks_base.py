@@ -1,11 +1,10 @@
 import re
 
-import numpy as np
 import pandas as pd
-import scipy.stats
 
 import wald_wolfowitz
 import streak_converter
+import instrumentation
 
 class StreaksBase:
     """
@@ -25,25 +24,22 @@ class StreaksBase:
     def get_variances(self, makes, misses, expected_streaks):
         return wald_wolfowitz.get_variance(makes, misses, expected_streaks)
 
-    def calc_stats(self, df, percentile_ranks=False):
-        df['expected_streaks'] = self.get_expected_streaks(df.makes, df.misses)
-        df['variance'] = self.get_variances(df.makes, df.misses, df.expected_streaks)
-        df['sd'] = np.sqrt(df.variance)
-        df['z_score'] = (df.total_streaks - df.expected_streaks) / df.sd
-
-        df['ww_percentile'] = 100 * scipy.stats.norm.cdf(df.z_score.tolist())
+    @instrumentation.timed("calc_stats")
+    def calc_stats(self, df, percentile_ranks=False, method="normal"):
+        # see wald_wolfowitz.get_streak_stats for `method`
+        stats = wald_wolfowitz.get_streak_stats(df.makes, df.misses, df.total_streaks, method)
+        for column in ["expected_streaks", "variance", "sd", "z_score", "ww_percentile"]:
+            df[column] = stats[column]
 
         if percentile_ranks:
             # get percentile rank data
-            # this will be unbelievably slow on large datasets (makes + misses > 50, say)
-            # and the difference from the WW percentile will be minimal.x
-            df['exact_percentile_rank'] = None
-
-            for row_id, data in df.iterrows():
-                df.loc[row_id, "exact_percentile_rank"] = wald_wolfowitz.get_percentile_rank(data['makes'], data['misses'], data['total_streaks'])
-                
-            df['z_from_percentile_rank'] = scipy.stats.norm.ppf(
-                (df['exact_percentile_rank'].values/ 100).tolist())
+            # the difference from the WW percentile will be minimal on large datasets.
+            with instrumentation.stage("percentile_ranks", rows=len(df)):
+                df['exact_percentile_rank'] = wald_wolfowitz.get_percentile_ranks(
+                    df.makes, df.misses, df.total_streaks)
+
+            df['z_from_percentile_rank'] = wald_wolfowitz.get_z_from_percentile_ranks(
+                df['exact_percentile_rank'].values)
 
         #clean_df = df[(df.total_streaks > 0) & (df.variance > 0)].copy()
         clean_df = df.copy()
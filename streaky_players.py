@@ -1,11 +1,15 @@
 import numpy as np
+import pandas as pd
 
 rng = np.random.default_rng(2718)
 
+# VariableFGPlayer draws this many random shot types at a time
+SHOT_TYPE_BATCH_SIZE = 1024
+
 class BasePlayer:
     def __init__(self, shooting_percentage):
         self.rng = rng
-        if shooting_percentage:
+        if shooting_percentage is not None:
             self.shooting_percentage = shooting_percentage        
         self.game_history = []
         self.shoot_pct_history = []
@@ -17,6 +21,12 @@ class BasePlayer:
     def get_random(self):
         return self.rng.random()
     
+    def take_shots(self, num_shots):
+        """
+        takes `num_shots` shots in a row. returns an array of makes (1) and misses (0)
+        """
+        return np.array([self.take_shot() for x in range(num_shots)], dtype=np.int64)
+
     def take_shot(self):
         shoot_pct = self.get_shooting_percentage()
         # this allows me to track the shooting percentage changes due to streakiness
@@ -41,15 +51,72 @@ class VariableFGPlayer(BasePlayer):
 
     """
     def __init__(self, shooting_weights, shooting_percentages):
-        self.shooting_weights = shooting_weights
-        self.shooting_percentages = shooting_percentages
+        self.shooting_weights = np.asarray(shooting_weights, dtype=np.float64)
+        self.shooting_percentages = np.asarray(shooting_percentages, dtype=np.float64)
+        # picking a shot type is a searchsorted on the cumulative weights
+        self.cumulative_weights = np.cumsum(self.shooting_weights) / self.shooting_weights.sum()
+        self.shot_type_buffer = np.array([], dtype=np.int64)
+        self.buffer_position = 0
         return super().__init__(None)
 
+    def get_shot_types(self, num_shots):
+        """
+        randomly picks `num_shots` shot types (indexes into shooting_percentages) at once.
+        """
+        shot_types = np.searchsorted(self.cumulative_weights, self.rng.random(num_shots), side="right")
+        return np.minimum(shot_types, len(self.cumulative_weights) - 1)
+
     def get_shooting_percentage(self):
-        ## the rng.choice function is ridiculously slow... this simulation runs
-        ## about 10x slower than the LastFivePlayer below because of this function.
-        return rng.choice(self.shooting_percentages, p=self.shooting_weights)
+        ## rng.choice per shot was ridiculously slow (this simulation ran about 10x
+        ## slower than the LastFivePlayer below), so shot types are drawn in batches.
+        if self.buffer_position >= len(self.shot_type_buffer):
+            self.shot_type_buffer = self.get_shot_types(SHOT_TYPE_BATCH_SIZE)
+            self.buffer_position = 0
+        shot_type = self.shot_type_buffer[self.buffer_position]
+        self.buffer_position += 1
+        return self.shooting_percentages[shot_type]
+
+    def take_shots(self, num_shots):
+        """
+        takes a whole game's worth of shots at once. nothing here depends on earlier shots,
+        so the shot types and results can all be drawn in one go.
+        """
+        shoot_pcts = self.shooting_percentages[self.get_shot_types(num_shots)]
+        results = (self.rng.random(num_shots) < shoot_pcts).astype(np.int64)
+        self.shoot_pct_history.extend(shoot_pcts)
+        self.game_history.extend(results)
+        return results
+
+class ZonePlayer(VariableFGPlayer):
+    """
+    VariableFGPlayer with a real player's shot diet: how often they shoot from each zone,
+    and their FG% from there (see get_zone_table)
+
+    >>> zone_table = pd.DataFrame({"frequency": [.6, .4], "fg_pct": [.6, .35]},
+    ...                           index=["Restricted Area", "Above the Break 3"])
+    >>> player = ZonePlayer(zone_table)
+    >>> len(player.take_shots(20))
+    20
+    """
+    def __init__(self, zone_table):
+        self.zones = list(zone_table.index)
+        super().__init__(zone_table["frequency"].values, zone_table["fg_pct"].values)
 
+    @classmethod
+    def from_shots(cls, shots, zone_column="BASIC_ZONE"):
+        return cls(get_zone_table(shots, zone_column))
+
+def get_zone_table(shots, zone_column="BASIC_ZONE"):
+    """
+    shot frequency and FG% by zone, from kaggle shot data (eg. all of one player's shots)
+    """
+    by_zone = shots.groupby(zone_column, observed=True)["SHOT_MADE"]
+    attempts = by_zone.count()
+    return pd.DataFrame({
+        "attempts": attempts,
+        "frequency": attempts / attempts.sum(),
+        "fg_pct": by_zone.mean(),
+    })
 
 class LastFivePlayer(BasePlayer):
     """
@@ -106,6 +173,27 @@ class LukewarmPlayer(BasePlayer):
                 ## player is currently not on a hot/cold streak
                 return self.shooting_percentage
 
+    def get_shooting_percentages(self, shooting_percentages, makes, attempts):
+        """
+        vectorized get_shooting_percentage, using this player's thresholds and boosts,
+        for a whole batch of player-games at once. each argument is an array
+        with one entry per player-game: their base shooting percentage, and their
+        makes and attempts so far in the game.
+        """
+        shooting_percentages = np.asarray(shooting_percentages, dtype=np.float64)
+        makes = np.asarray(makes)
+        attempts = np.broadcast_to(attempts, makes.shape)
+
+        game_percentage = np.divide(makes, attempts, out=np.zeros(makes.shape), where=attempts > 0)
+        streaky = attempts >= self.MIN_ATTEMPTS
+        cold = streaky & (game_percentage < self.LOWER_THRESH)
+        hot = streaky & ~cold & (game_percentage > self.UPPER_THRESH)
+
+        percentages = shooting_percentages.copy()
+        percentages[cold] = np.minimum(shooting_percentages[cold] + self.BOOST_POS_AMOUNT, 1)
+        percentages[hot] = np.maximum(shooting_percentages[hot] + self.BOOST_NEG_AMOUNT, 0)
+        return percentages
+
 class NormalPlayer(LukewarmPlayer):
     """
     this is a default player, with no streaky or non-streaky tendencies.
@@ -4,6 +4,17 @@ import math
 
 import functools
 
+import instrumentation
+
+# makes/misses up to this are precomputed in the PMF table, bigger ones are
+# computed on demand and kept in an LRU cache.
+MAX_TABLE_SHOTS = 50
+LRU_SIZE = 1024
+
+# with method="auto", z-scores for this many shots or fewer come from the exact
+# distribution, since the normal approximation is rough for small samples.
+EXACT_Z_MAX_SHOTS = 50
+
 def get_expected_streaks(makes, misses):
     """
     Use Wald_Wolfowitz test to compute expected number of streaks.
@@ -31,7 +42,6 @@ def get_variance(makes, misses, expected_streaks):
 
     return np.divide(numerator, denominator)
 
-@functools.cache
 def get_exact_pmf(makes, misses):
     """
     returns the exact PMF of the number of runs in makes, misses combos.
@@ -48,8 +58,6 @@ def get_exact_pmf(makes, misses):
     9    0.045455
     dtype: float64
     """
-    pmf = []
-
     assert makes  >= 0, "makes must be >=0"
     assert misses >= 0, "misses must be >=0"
 
@@ -64,28 +72,8 @@ def get_exact_pmf(makes, misses):
     # with the rest of the larger one as one streak at the end.
     max_streaks = (2 * smaller_one) + 1
 
-    for r in range(min_streaks, max_streaks+1):
-        if (r % 2) == 0:
-            pmf.append(_get_even(r/2, makes, misses))
-        else:
-            pmf.append(_get_odd((r-1)/2, makes, misses))
-    return pd.Series(pmf, index=range(min_streaks, max_streaks+1))
-
-@functools.cache
-def _comb(x,y):
-    return math.comb(x, y)
-
-def _get_even(k, n1, n2):
-    k = int(k)
-    numer = 2 * _comb(n1-1, k-1) * _comb(n2-1, k-1)
-    denom = _comb(n1+n2, n1)
-    return numer/denom
-
-def _get_odd(k, n1, n2):
-    k = int(k)
-    numer = (_comb(n1-1, k) * _comb(n2-1, k-1)) + (_comb(n2-1, k) * _comb(n1-1, k-1))
-    denom = _comb(n1+n2, n1)
-    return numer/denom
+    pmf = get_table().get_pmf(makes, misses)
+    return pd.Series(pmf[min_streaks:max_streaks+1], index=range(min_streaks, max_streaks+1))
 
 def get_percentile_rank(makes, misses, runs):
     """
@@ -99,6 +87,284 @@ def get_percentile_rank(makes, misses, runs):
     calced = (sum(pmf[pmf.index <= runs])  - (.5 * pmf[pmf.index == runs])) * 100
     return calced.values[0]
 
+def _log_comb(n, k):
+    """
+    log of (n choose k), vectorized. returns -inf where the combination is zero
+    (k < 0 or k > n), so it can be added up in log space.
+    """
+    # scipy is slow to import, and most lookups never get here (see PmfTable)
+    import scipy.special
+
+    n = np.asarray(n, dtype=np.float64)
+    k = np.asarray(k, dtype=np.float64)
+    valid = (k >= 0) & (k <= n)
+    with np.errstate(invalid="ignore"):
+        log_comb = (scipy.special.gammaln(n + 1) - scipy.special.gammaln(k + 1)
+                    - scipy.special.gammaln(n - k + 1))
+    return np.where(valid, log_comb, -np.inf)
+
+def get_log_pmf(makes, misses):
+    """
+    log of the exact PMF of the number of runs, computed with lgamma instead of
+    math.comb so it doesn't overflow (or lose precision) for whole careers.
+    the array is indexed by number of runs, from 0 to the max possible;
+    impossible run counts are -inf.
+
+    >>> np.exp(get_log_pmf(7,4)).round(6)
+    array([0.      , 0.      , 0.006061, 0.027273, 0.109091, 0.190909,
+           0.272727, 0.227273, 0.121212, 0.045455])
+    """
+    makes = int(makes)
+    misses = int(misses)
+    assert makes  >= 0, "makes must be >=0"
+    assert misses >= 0, "misses must be >=0"
+
+    if (makes == 0) or (misses == 0):
+        # only one way this could go -- 1 run, or 0 runs if there are no shots at all.
+        log_pmf = np.full(2, -np.inf)
+        log_pmf[min(makes + misses, 1)] = 0.0
+        return log_pmf
+
+    max_streaks = (2 * min(makes, misses)) + 1
+    runs = np.arange(max_streaks + 1)
+    log_denom = _log_comb(makes + misses, makes)
+
+    # even number of runs: r = 2k
+    k = runs // 2
+    log_even = (np.log(2) + _log_comb(makes - 1, k - 1) + _log_comb(misses - 1, k - 1))
+
+    # odd number of runs: r = 2k + 1
+    log_odd = np.logaddexp(_log_comb(makes - 1, k) + _log_comb(misses - 1, k - 1),
+                           _log_comb(misses - 1, k) + _log_comb(makes - 1, k - 1))
+
+    log_pmf = np.where(runs % 2 == 0, log_even, log_odd) - log_denom
+    log_pmf[:2] = -np.inf
+    return log_pmf
+
+@functools.lru_cache(maxsize=LRU_SIZE)
+def _get_pmf_and_cdf(makes, misses):
+    """
+    PMF and CDF (P(runs <= r)) arrays indexed by runs, for pairs that don't fit
+    in the precomputed table. these are kept in a bounded LRU cache.
+    """
+    log_pmf = get_log_pmf(makes, misses)
+    pmf = np.exp(log_pmf)
+    cdf = np.minimum(np.exp(np.logaddexp.accumulate(log_pmf)), 1.0)
+    pmf.flags.writeable = False
+    cdf.flags.writeable = False
+    return pmf, cdf
+
+class PmfTable:
+    """
+    precomputed exact PMF and CDF of the number of runs for every (makes, misses)
+    pair up to `max_shots` each, stored as one contiguous array so percentile
+    ranks are just array lookups. pairs bigger than the table fall back to
+    an LRU cache.
+
+    the table can be saved to a .npy file and memory-mapped by other processes,
+    so it only has to be built once.
+
+    >>> table = PmfTable(10)
+    >>> table.percentile_ranks([7, 30], [4, 2], [7, 5])
+    array([71.96969697, 59.07258065])
+    """
+    def __init__(self, max_shots=MAX_TABLE_SHOTS, data=None):
+        if data is None:
+            data = self._build(max_shots)
+        # data[0] is the pmf, data[1] is the cdf, both indexed [makes, misses, runs]
+        self.data = data
+        self.max_shots = data.shape[1] - 1
+        self.max_runs = data.shape[3] - 1
+
+    @staticmethod
+    def _build(max_shots):
+        # small enough to do with exact integer arithmetic. this only happens once.
+        data = np.zeros((2, max_shots + 1, max_shots + 1, (2 * max_shots) + 2))
+        for makes in range(max_shots + 1):
+            for misses in range(max_shots + 1):
+                if (makes == 0) or (misses == 0):
+                    data[0, makes, misses, min(makes + misses, 1)] = 1.0
+                else:
+                    denom = math.comb(makes + misses, makes)
+                    for r in range(2, (2 * min(makes, misses)) + 2):
+                        k = r // 2
+                        if (r % 2) == 0:
+                            numer = 2 * math.comb(makes-1, k-1) * math.comb(misses-1, k-1)
+                        else:
+                            numer = ((math.comb(makes-1, k) * math.comb(misses-1, k-1)) +
+                                     (math.comb(misses-1, k) * math.comb(makes-1, k-1)))
+                        data[0, makes, misses, r] = numer / denom
+        data[1] = np.minimum(np.cumsum(data[0], axis=2), 1.0)
+        return data
+
+    def save(self, filename):
+        np.save(filename, self.data)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        return cls(data=np.load(filename, mmap_mode="r" if mmap else None))
+
+    def in_table(self, makes, misses):
+        return (makes <= self.max_shots) & (misses <= self.max_shots)
+
+    def get_pmf(self, makes, misses):
+        if self.in_table(makes, misses):
+            instrumentation.count("pmf_table.hits")
+            return self.data[0, makes, misses]
+        instrumentation.count("pmf_table.misses")
+        return _get_pmf_and_cdf(int(makes), int(misses))[0]
+
+    def get_cdf(self, makes, misses):
+        if self.in_table(makes, misses):
+            return self.data[1, makes, misses]
+        return _get_pmf_and_cdf(int(makes), int(misses))[1]
+
+    def percentile_ranks(self, makes, misses, runs):
+        """
+        exact percentile ranks for arrays of makes, misses and runs.
+        rows with no shots come back as NaN.
+        """
+        makes = np.asarray(makes, dtype=np.int64)
+        misses = np.asarray(misses, dtype=np.int64)
+        runs = np.asarray(runs, dtype=np.int64)
+
+        ranks = np.full(len(makes), np.nan)
+
+        has_shots = (makes + misses) > 0
+        fits = has_shots & self.in_table(makes, misses) & (runs <= self.max_runs) & (runs >= 0)
+        m, n, r = makes[fits], misses[fits], runs[fits]
+        below = np.where(r > 0, self.data[1, m, n, np.maximum(r - 1, 0)], 0.0)
+        ranks[fits] = 100 * (below + (.5 * self.data[0, m, n, r]))
+
+        # everything else is looked up one distinct (makes, misses) pair at a time
+        rest = np.flatnonzero(~fits & has_shots)
+        instrumentation.count("pmf_table.hits", len(m))
+        instrumentation.count("pmf_table.misses", len(rest))
+        if len(rest) == 0:
+            return ranks
+
+        pairs, inverse = np.unique(np.stack([makes[rest], misses[rest]], axis=1),
+                                   axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind="stable")
+        group_starts = np.searchsorted(inverse[order], np.arange(len(pairs)))
+
+        for (pair_makes, pair_misses), rows in zip(pairs, np.split(rest[order], group_starts[1:])):
+            pmf, cdf = _get_pmf_and_cdf(int(pair_makes), int(pair_misses))
+            pair_runs = runs[rows]
+            # anything past the max possible number of runs is at the 100th percentile.
+            in_range = pair_runs < len(pmf)
+            clipped = np.clip(pair_runs, 0, len(pmf) - 1)
+            below = np.where(clipped > 0, cdf[np.maximum(clipped - 1, 0)], 0.0)
+            ranks[rows] = np.where(in_range, 100 * (below + (.5 * pmf[clipped])), 100.0)
+
+        return ranks
+
+instrumentation.register_cache("wald_wolfowitz.pmf_lru", lambda: _get_pmf_and_cdf.cache_info()._asdict())
+
+_table = None
+
+def get_table():
+    """
+    the PmfTable used by get_exact_pmf and get_percentile_ranks. it gets built
+    the first time it's needed, unless one has been loaded with load_table().
+    """
+    global _table
+    if _table is None:
+        _table = PmfTable()
+    return _table
+
+def load_table(filename, mmap=True):
+    """
+    use a PmfTable saved with PmfTable.save() instead of building one.
+    """
+    global _table
+    _table = PmfTable.load(filename, mmap)
+    return _table
+
+def get_percentile_ranks(makes, misses, runs):
+    """
+    vectorized version of get_percentile_rank. takes arrays (or Series) of makes,
+    misses and runs and returns an array of exact percentile ranks.
+    rows with no shots come back as NaN.
+
+    >>> get_percentile_ranks([7, 7, 2], [4, 4, 3], [7, 2, 4])
+    array([71.96969697,  0.3030303 , 70.        ])
+    >>> get_percentile_ranks([0], [0], [0])
+    array([nan])
+    """
+    return get_table().percentile_ranks(makes, misses, runs)
+
+def get_z_from_percentile_ranks(percentile_ranks):
+    """
+    the z-score with the same percentile as an exact percentile rank.
+
+    >>> get_z_from_percentile_ranks([50, 97.5])
+    array([0.        , 1.95996398])
+    """
+    import scipy.special
+    return scipy.special.ndtri(np.asarray(percentile_ranks, dtype=np.float64) / 100)
+
+def get_streak_stats(makes, misses, runs, method="normal", exact_max_shots=EXACT_Z_MAX_SHOTS):
+    """
+    all the Wald-Wolfowitz stats for arrays (or Series) of makes, misses and
+    runs in one go: expected_streaks, variance, sd, z_score and ww_percentile,
+    as a dict of numpy arrays.
+
+    rows that don't have a usable variance (fewer than 2 shots, or all makes or
+    all misses) get NaN for variance, sd, z_score and ww_percentile.
+
+    `method` is how the z-score is calculated:
+      "normal":      (runs - expected) / sd
+      "continuity":  same, but with runs moved .5 towards the expected value,
+                     since runs only come in whole numbers
+      "auto":        from the exact distribution (see get_percentile_ranks) for
+                     rows with up to `exact_max_shots` shots, "continuity" for
+                     the rest
+
+    >>> stats = get_streak_stats([7, 7, 5], [4, 4, 0], [7, 2, 1])
+    >>> stats["expected_streaks"], stats["z_score"]
+    (array([6.09090909, 6.09090909, 1.        ]), array([ 0.62994079, -2.83473355,         nan]))
+    >>> get_streak_stats([7, 7], [4, 4], [7, 2], method="continuity")["z_score"]
+    array([ 0.28347335, -2.48826611])
+    """
+    import scipy.special
+
+    makes = np.asarray(makes, dtype=np.float64)
+    misses = np.asarray(misses, dtype=np.float64)
+    runs = np.asarray(runs, dtype=np.float64)
+    shots = makes + misses
+
+    expected = np.full(len(shots), np.nan)
+    np.divide(2 * makes * misses, shots, out=expected, where=shots > 0)
+    expected += 1
+
+    # expected > 2 means there are makes and misses, so the variance is > 0.
+    usable = (shots > 1) & (expected > 2)
+    variance = np.full(len(shots), np.nan)
+    np.divide((expected - 1) * (expected - 2), shots - 1, out=variance, where=usable)
+    sd = np.sqrt(variance)
+
+    difference = runs - expected
+    if method == "normal":
+        z_score = difference / sd
+    elif method in ("continuity", "auto"):
+        z_score = np.sign(difference) * np.maximum(np.abs(difference) - .5, 0) / sd
+        if method == "auto":
+            use_exact = usable & (shots <= exact_max_shots)
+            if use_exact.any():
+                ranks = get_percentile_ranks(makes[use_exact], misses[use_exact], runs[use_exact])
+                z_score[use_exact] = get_z_from_percentile_ranks(ranks)
+    else:
+        raise ValueError(f"unknown method: {method}")
+
+    return {
+        "expected_streaks": expected,
+        "variance": variance,
+        "sd": sd,
+        "z_score": z_score,
+        "ww_percentile": 100 * scipy.special.ndtr(z_score),
+    }
 
 if __name__ == "__main__":
     import doctest